@@ -1,8 +1,61 @@
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import cache, db, instrument, ratelimit, responses, tokens
+from shared.params import parse_id_list
+
+MAX_BATCH_IDS = 200
+REPORTABLE_TYPES = ('pin', 'comment')
+# POST actions that only read, and so may be served by a replica
+READ_ACTIONS = ('get_favorites', 'is_favorite', 'favorite_status')
+# Actions on the caller's own favorites, which need a session token
+USER_ACTIONS = ('favorite',) + READ_ACTIONS
+
+# Counters only move for reports that were actually inserted, so repeat reports
+# from the same IP are free and never touch the pin or comment row
+REPORT_SQL = """
+    WITH inserted AS (
+        INSERT INTO reports (user_ip, entity_type, entity_id)
+        SELECT %(user_ip)s, r.entity_type, r.entity_id
+        FROM unnest(%(entity_types)s::varchar[], %(entity_ids)s::int[]) AS r(entity_type, entity_id)
+        ON CONFLICT DO NOTHING
+        RETURNING entity_type, entity_id
+    ), pin_hits AS (
+        UPDATE pins p SET reports = p.reports + 1
+        FROM inserted i
+        WHERE i.entity_type = 'pin' AND p.id = i.entity_id
+        RETURNING p.id
+    ), comment_hits AS (
+        UPDATE comments c SET reports = c.reports + 1
+        FROM inserted i
+        WHERE i.entity_type = 'comment' AND c.id = i.entity_id
+        RETURNING c.id, c.pin_id
+    )
+    SELECT 'pin' as entity_type, id as entity_id, id as pin_id FROM pin_hits
+    UNION ALL
+    SELECT 'comment', id, pin_id FROM comment_hits
+"""
+
+def parse_reports(body_data):
+    '''Single {entity_type, entity_id} or a `reports` list of them; deduplicated, None if invalid'''
+    items = body_data.get('reports')
+    if items is None:
+        items = [{'entity_type': body_data.get('entity_type'), 'entity_id': body_data.get('entity_id')}]
+    if not isinstance(items, list) or not items or len(items) > MAX_BATCH_IDS:
+        return None
+    reports = set()
+    for item in items:
+        if not isinstance(item, dict) or item.get('entity_type') not in REPORTABLE_TYPES:
+            return None
+        try:
+            reports.add((item['entity_type'], int(item.get('entity_id'))))
+        except (TypeError, ValueError):
+            return None
+    return sorted(reports)
+
+@instrument.handler('actions')
 def handler(event, context):
     '''
     Business: Handle reports, favorites and admin actions
@@ -12,149 +65,150 @@ def handler(event, context):
     method = event.get('httpMethod', 'POST')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-User-IP',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+        return responses.preflight('GET, POST, OPTIONS', 'Content-Type, X-User-Id, X-User-IP, Authorization, X-Read-After')
     
+    read_only = method == 'GET'
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
-        action = body_data.get('action')
+        user_id = None
+        if body_data.get('action') in USER_ACTIONS:
+            # Favorites belong to whoever the session token says, never a body field
+            claims, denied = tokens.require_user(event)
+            if denied:
+                return denied
+            user_id = claims['sub']
+        cost = 1
+        if body_data.get('action') == 'report':
+            # Each report in a batch spends its own token
+            reports = parse_reports(body_data)
+            if reports is None:
+                return responses.error(400, 'Invalid report')
+            burst = ratelimit.burst('report')
+            if burst is not None and len(reports) > burst:
+                return responses.error(400, f'At most {burst} reports per request')
+            cost = len(reports)
+        limited = ratelimit.check(body_data.get('action'), event, user_id, cost)
+        if limited:
+            return limited
+        read_only = body_data.get('action') in READ_ACTIONS
+    
+    with db.connection(read_only=read_only, min_lsn=db.read_after(event)) as conn:
+        cur = db.dict_cursor(conn)
         
-        if action == 'report':
-            entity_type = body_data.get('entity_type')
-            entity_id = body_data.get('entity_id')
-            user_ip = event.get('headers', {}).get('x-forwarded-for', '0.0.0.0').split(',')[0]
+        if method == 'POST':
+            action = body_data.get('action')
             
-            cur.execute(
-                "INSERT INTO reports (user_ip, entity_type, entity_id) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
-                (user_ip, entity_type, entity_id)
-            )
+            if action == 'report':
+                user_ip = ratelimit.client_ip(event)
+                
+                cur.execute(REPORT_SQL, {
+                    'user_ip': user_ip,
+                    'entity_types': [entity_type for entity_type, _ in reports],
+                    'entity_ids': [entity_id for _, entity_id in reports]
+                })
+                counted = cur.fetchall()
+                
+                pin_ids = {row['pin_id'] for row in counted}
+                cache.invalidate(*[cache.pin_key(pin_id) for pin_id in pin_ids])
+                if any(row['entity_type'] == 'pin' for row in counted):
+                    cache.bump('feed')
+                for pin_id in {row['pin_id'] for row in counted if row['entity_type'] == 'comment'}:
+                    cache.bump(cache.comments_namespace(pin_id))
+                
+                return responses.json_response(200, {
+                    'success': True,
+                    'counted': [{'entity_type': row['entity_type'], 'entity_id': row['entity_id']} for row in counted]
+                }, event, db.write_token(conn))
             
-            if entity_type == 'pin':
-                cur.execute("UPDATE pins SET reports = reports + 1 WHERE id = %s", (entity_id,))
-            elif entity_type == 'comment':
-                cur.execute("UPDATE comments SET reports = reports + 1 WHERE id = %s", (entity_id,))
+            elif action == 'favorite':
+                pin_id = body_data.get('pin_id')
+                is_favorite = body_data.get('is_favorite', True)
+                
+                if is_favorite:
+                    cur.execute(
+                        "INSERT INTO favorites (user_id, pin_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                        (user_id, pin_id)
+                    )
+                else:
+                    cur.execute(
+                        "DELETE FROM favorites WHERE user_id = %s AND pin_id = %s",
+                        (user_id, pin_id)
+                    )
+                cache.bump(cache.favorites_namespace(user_id))
+                
+                return responses.json_response(200, {'success': True}, event, db.write_token(conn))
             
-            conn.commit()
-            cur.close()
-            conn.close()
+            elif action == 'get_favorites':
+                cur.execute("""
+                    SELECT p.id, p.title, p.preview, p.content_length, p.author_id, p.is_private, p.tags,
+                        p.views, p.comment_count, p.reports, p.created_at, u.username as author, u.is_verified as author_verified
+                    FROM pins p
+                    JOIN users u ON p.author_id = u.id
+                    JOIN favorites f ON f.pin_id = p.id
+                    WHERE f.user_id = %s AND p.reports < 10
+                    ORDER BY f.created_at DESC
+                """, (user_id,))
+                
+                pins = cur.fetchall()
+                
+                return responses.json_response(200, {'pins': pins}, event)
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'favorite':
-            user_id = body_data.get('user_id')
-            pin_id = body_data.get('pin_id')
-            is_favorite = body_data.get('is_favorite', True)
-            
-            if is_favorite:
+            elif action == 'is_favorite':
+                pin_id = body_data.get('pin_id')
+                
                 cur.execute(
-                    "INSERT INTO favorites (user_id, pin_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                    "SELECT id FROM favorites WHERE user_id = %s AND pin_id = %s",
                     (user_id, pin_id)
                 )
-            else:
+                favorite = cur.fetchone()
+                
+                return responses.json_response(200, {'is_favorite': favorite is not None}, event)
+            
+            elif action == 'favorite_status':
+                pin_ids = parse_id_list(body_data.get('pin_ids'), MAX_BATCH_IDS)
+                
+                if pin_ids is None:
+                    return responses.error(400, f'Up to {MAX_BATCH_IDS} pin_ids required')
+                
                 cur.execute(
-                    "DELETE FROM favorites WHERE user_id = %s AND pin_id = %s",
-                    (user_id, pin_id)
+                    "SELECT pin_id FROM favorites WHERE user_id = %s AND pin_id = ANY(%s)",
+                    (user_id, pin_ids)
                 )
-            
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
+                favorites = [row['pin_id'] for row in cur.fetchall()]
+                
+                return responses.json_response(200, {'favorites': favorites}, event)
         
-        elif action == 'get_favorites':
-            user_id = body_data.get('user_id')
+        elif method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            action = params.get('action')
             
-            cur.execute("""
-                SELECT p.*, u.username as author, u.is_verified as author_verified
-                FROM pins p
-                JOIN users u ON p.author_id = u.id
-                JOIN favorites f ON f.pin_id = p.id
-                WHERE f.user_id = %s AND p.reports < 10
-                ORDER BY f.created_at DESC
-            """, (user_id,))
-            
-            pins = cur.fetchall()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'pins': [dict(p) for p in pins]}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'is_favorite':
-            user_id = body_data.get('user_id')
-            pin_id = body_data.get('pin_id')
-            
-            cur.execute(
-                "SELECT id FROM favorites WHERE user_id = %s AND pin_id = %s",
-                (user_id, pin_id)
-            )
-            favorite = cur.fetchone()
-            cur.close()
-            conn.close()
+            if action == 'check_report':
+                entity_type = params.get('entity_type')
+                entity_id = params.get('entity_id')
+                user_ip = ratelimit.client_ip(event)
+                
+                cur.execute(
+                    "SELECT id FROM reports WHERE user_ip = %s AND entity_type = %s AND entity_id = %s",
+                    (user_ip, entity_type, entity_id)
+                )
+                reported = cur.fetchone()
+                
+                return responses.json_response(200, {'reported': reported is not None}, event)
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'is_favorite': favorite is not None}),
-                'isBase64Encoded': False
-            }
-    
-    elif method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        action = params.get('action')
+            elif action == 'check_reports':
+                entity_type = params.get('entity_type')
+                entity_ids = parse_id_list(params.get('entity_ids', ''), MAX_BATCH_IDS)
+                user_ip = ratelimit.client_ip(event)
+                
+                if not entity_type or entity_ids is None:
+                    return responses.error(400, f'entity_type and up to {MAX_BATCH_IDS} entity_ids required')
+                
+                cur.execute(
+                    "SELECT entity_id FROM reports WHERE user_ip = %s AND entity_type = %s AND entity_id = ANY(%s)",
+                    (user_ip, entity_type, entity_ids)
+                )
+                reported = [row['entity_id'] for row in cur.fetchall()]
+                
+                return responses.json_response(200, {'reported': reported}, event)
         
-        if action == 'check_report':
-            entity_type = params.get('entity_type')
-            entity_id = params.get('entity_id')
-            user_ip = event.get('headers', {}).get('x-forwarded-for', '0.0.0.0').split(',')[0]
-            
-            cur.execute(
-                "SELECT id FROM reports WHERE user_ip = %s AND entity_type = %s AND entity_id = %s",
-                (user_ip, entity_type, entity_id)
-            )
-            reported = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'reported': reported is not None}),
-                'isBase64Encoded': False
-            }
-    
-    cur.close()
-    conn.close()
-    return {
-        'statusCode': 400,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Invalid action'}),
-        'isBase64Encoded': False
-    }
+        return responses.error(400, 'Invalid action')
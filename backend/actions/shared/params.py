@@ -0,0 +1,16 @@
+'''Request parameter parsing shared by the function handlers'''
+
+def escape_like(value):
+    '''Escape LIKE/ILIKE wildcards so user input matches literally'''
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def parse_id_list(value, max_ids):
+    '''Accept a JSON list or a comma-separated string of ids; None if invalid or longer than max_ids'''
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+    if not isinstance(value, list) or len(value) > max_ids:
+        return None
+    try:
+        return sorted({int(item) for item in value})
+    except (TypeError, ValueError):
+        return None
@@ -1,8 +1,41 @@
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import cache, db, instrument, responses, tokens
+from shared.pagination import decode_position, encode_cursor, is_int, is_timestamp, parse_page_size
+from shared.params import escape_like, parse_id_list
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_BATCH_IDS = 1000
+
+USER_UPDATES = {
+    'ban': 'is_banned = true',
+    'unban': 'is_banned = false',
+    'verify': 'is_verified = true',
+    'unverify': 'is_verified = false'
+}
+
+# Hides everything the given users wrote that is still visible, the same way
+# pin DELETE and the report thresholds do
+HIDE_CONTENT_SQL = """
+    WITH hidden_pins AS (
+        UPDATE pins SET reports = 999
+        WHERE author_id = ANY(%(user_ids)s) AND reports < 10
+        RETURNING id
+    ), hidden_comments AS (
+        UPDATE comments SET reports = 999
+        WHERE author_id = ANY(%(user_ids)s) AND reports < 5
+        RETURNING pin_id
+    )
+    SELECT 'pin' as entity_type, id as pin_id FROM hidden_pins
+    UNION ALL
+    SELECT 'comment', pin_id FROM hidden_comments
+"""
+
+@instrument.handler('admin')
 def handler(event, context):
     '''
     Business: Handle admin operations (list users, ban, verify)
@@ -12,134 +45,104 @@ def handler(event, context):
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return responses.preflight('GET, POST, OPTIONS', 'Content-Type, X-User-Id, Authorization, X-Read-After')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    _, denied = tokens.require_role(event, 'admin')
+    if denied:
+        return denied
     
-    if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        admin_id = params.get('admin_id')
-        search = params.get('search', '')
+    with db.connection(read_only=method == 'GET', min_lsn=db.read_after(event)) as conn:
+        cur = db.dict_cursor(conn)
         
-        if not admin_id:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Not authorized'}),
-                'isBase64Encoded': False
-            }
+        if method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            search = params.get('search', '')
+            
+            if params.get('action') == 'pool_stats':
+                return responses.json_response(200, {'pool': db.pool_stats()}, event)
+            
+            search = search.strip()
+            limit = parse_page_size(params.get('limit'), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+            if search:
+                # Trigram index serves both the substring match and the similarity ranking
+                cur.execute("""
+                    SELECT id, username, is_verified, is_banned, created_at
+                    FROM users
+                    WHERE username ILIKE %s OR username %% %s
+                    ORDER BY similarity(username, %s) DESC, created_at DESC
+                    LIMIT %s
+                """, (f'%{escape_like(search)}%', search, search, limit))
+                return responses.json_response(200, {'users': cur.fetchall(), 'next_cursor': None}, event)
+            
+            conditions = []
+            query_params = []
+            cursor_token = params.get('cursor')
+            if cursor_token:
+                position = decode_position(cursor_token, is_timestamp, is_int)
+                if not position:
+                    return responses.error(400, 'Invalid cursor')
+                conditions.append('(created_at, id) < (%s::timestamp, %s)')
+                query_params.extend(position)
+            
+            cur.execute(f"""
+                SELECT id, username, is_verified, is_banned, created_at
+                FROM users
+                {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """, query_params + [limit + 1])
+            
+            users = cur.fetchall()
+            
+            next_cursor = None
+            if len(users) > limit:
+                users = users[:limit]
+                next_cursor = encode_cursor(users[-1]['created_at'].isoformat(), users[-1]['id'])
+            
+            return responses.json_response(200, {'users': users, 'next_cursor': next_cursor}, event)
         
-        cur.execute("SELECT username FROM users WHERE id = %s", (admin_id,))
-        admin = cur.fetchone()
+        elif method == 'POST':
+            body_data = json.loads(event.get('body', '{}'))
+            action = body_data.get('action')
+            
+            if action not in USER_UPDATES:
+                return responses.error(400, 'Invalid action')
+            
+            # `user_ids` applies the action to many users in one statement; `user_id` to one
+            requested = body_data['user_ids'] if 'user_ids' in body_data else [body_data.get('user_id')]
+            user_ids = parse_id_list(requested, MAX_BATCH_IDS)
+            if not user_ids:
+                return responses.error(400, 'Invalid user_ids')
+            hide_content = action == 'ban' and body_data.get('hide_content') is True
+            
+            hidden = []
+            with conn:
+                cur.execute(f"UPDATE users SET {USER_UPDATES[action]} WHERE id = ANY(%s) RETURNING id", (user_ids,))
+                updated = [row['id'] for row in cur.fetchall()]
+                if hide_content and updated:
+                    cur.execute(HIDE_CONTENT_SQL, {'user_ids': updated})
+                    hidden = cur.fetchall()
+            
+            for user_id in updated:
+                if action == 'ban':
+                    tokens.revoke(user_id)
+                elif action == 'unban':
+                    tokens.restore(user_id)
+            
+            if hidden:
+                cache.invalidate(*[cache.pin_key(pin_id) for pin_id in {row['pin_id'] for row in hidden}])
+                if any(row['entity_type'] == 'pin' for row in hidden):
+                    cache.bump('feed')
+                for pin_id in {row['pin_id'] for row in hidden if row['entity_type'] == 'comment'}:
+                    cache.bump(cache.comments_namespace(pin_id))
+            
+            return responses.json_response(200, {
+                'success': True,
+                'updated': updated,
+                'hidden': {
+                    'pins': sum(1 for row in hidden if row['entity_type'] == 'pin'),
+                    'comments': sum(1 for row in hidden if row['entity_type'] == 'comment')
+                }
+            }, event, db.write_token(conn))
         
-        if not admin or admin['username'] != 'Developer':
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Not authorized'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.execute("""
-            SELECT id, username, is_verified, is_banned, created_at
-            FROM users
-            WHERE username ILIKE %s
-            ORDER BY created_at DESC
-            LIMIT 100
-        """, (f'%{search}%',))
-        
-        users = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'users': [dict(u) for u in users]}, default=str),
-            'isBase64Encoded': False
-        }
-    
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        admin_id = body_data.get('admin_id')
-        action = body_data.get('action')
-        target_user_id = body_data.get('user_id')
-        
-        if not admin_id:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Not authorized'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.execute("SELECT username FROM users WHERE id = %s", (admin_id,))
-        admin = cur.fetchone()
-        
-        if not admin or admin['username'] != 'Developer':
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Not authorized'}),
-                'isBase64Encoded': False
-            }
-        
-        if action == 'ban':
-            cur.execute("UPDATE users SET is_banned = true WHERE id = %s", (target_user_id,))
-            conn.commit()
-        elif action == 'unban':
-            cur.execute("UPDATE users SET is_banned = false WHERE id = %s", (target_user_id,))
-            conn.commit()
-        elif action == 'verify':
-            cur.execute("UPDATE users SET is_verified = true WHERE id = %s", (target_user_id,))
-            conn.commit()
-        elif action == 'unverify':
-            cur.execute("UPDATE users SET is_verified = false WHERE id = %s", (target_user_id,))
-            conn.commit()
-        else:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid action'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'success': True}),
-            'isBase64Encoded': False
-        }
-    
-    cur.close()
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+        return responses.error(405, 'Method not allowed')
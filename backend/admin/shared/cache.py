@@ -0,0 +1,192 @@
+'''
+Read-through cache for serialized response bodies.
+
+Two tiers: a small in-process LRU (per container, short TTL) in front of an
+optional shared store. The shared store is chosen by CACHE_URL:
+`redis://...` uses Redis, `memory://` a process-local stand-in for tests and
+single-process runs. Unset means no shared tier: invalidations cannot reach
+other containers, so only the local tier (at most LOCAL_TTL old) is used.
+Writes invalidate exact keys; list endpoints whose keys depend on query shape
+live under a namespace whose version is bumped instead.
+'''
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared import responses
+
+# CACHE_DISABLED=1 turns every lookup into a miss (benchmarks of the database paths)
+ENABLED = os.environ.get('CACHE_DISABLED') != '1'
+LOCAL_MAX_ENTRIES = int(os.environ.get('CACHE_LOCAL_MAX_ENTRIES', '512'))
+# Other containers only see an invalidation once their local copy expires
+LOCAL_TTL = float(os.environ.get('CACHE_LOCAL_TTL', '5'))
+
+PIN_TTL = 60
+FEED_TTL = 15
+COMMENTS_TTL = 30
+
+class LRUStore:
+    '''In-process store with per-key TTL and LRU eviction'''
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def counter(self, key):
+        # Counters are kept apart from cached entries so eviction never resets them
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+
+class MemoryStore(LRUStore):
+    '''Local stand-in for the shared tier (tests, single-process runs)'''
+
+    def __init__(self):
+        super().__init__(max_entries=100000)
+
+class RedisStore:
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, ex=max(1, int(ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*keys)
+
+    def counter(self, key):
+        return int(self._client.get(key) or 0)
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+def _store_from_url(url):
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return MemoryStore()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisStore(url)
+    raise ValueError(f'Unsupported CACHE_URL: {url}')
+
+local = LRUStore()
+shared = _store_from_url(os.environ.get('CACHE_URL'))
+
+def configure(shared_store):
+    '''Swap the shared tier, e.g. for a MemoryStore in tests; None disables it'''
+    global shared
+    shared = shared_store
+    local.clear()
+
+def get(key):
+    '''Return (etag, body) or None'''
+    if not ENABLED:
+        return None
+    value = local.get(key)
+    if value is None and shared is not None:
+        value = shared.get(key)
+        if value is not None:
+            local.set(key, value, LOCAL_TTL)
+    if value is None:
+        return None
+    etag, _, body = value.partition('\n')
+    return etag, body
+
+def put(key, body, ttl):
+    '''Store an encoded body (bytes or str) and return its (etag, body) entry'''
+    if isinstance(body, bytes):
+        body = body.decode()
+    etag = make_etag(body)
+    if not ENABLED:
+        return etag, body
+    value = f'{etag}\n{body}'
+    local.set(key, value, min(ttl, LOCAL_TTL))
+    if shared is not None:
+        shared.set(key, value, ttl)
+    return etag, body
+
+def invalidate(*keys):
+    local.delete(*keys)
+    if shared is not None:
+        shared.delete(*keys)
+
+def version(namespace):
+    return (shared or local).counter(f'ns:{namespace}')
+
+def namespace_key(namespace, *parts):
+    '''Key under a namespace that bump() invalidates as a whole'''
+    return ':'.join([namespace, f'v{version(namespace)}'] + [str(p) for p in parts])
+
+def bump(namespace):
+    (shared or local).incr(f'ns:{namespace}')
+
+def pin_key(pin_id):
+    return f'pin:{pin_id}'
+
+def favorites_namespace(user_id):
+    return f'favorites:{user_id}'
+
+def comments_namespace(pin_id):
+    return f'comments:{pin_id}'
+
+def make_etag(body):
+    return '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+def respond(event, entry, status=200):
+    '''Build the response for a cached (etag, body), answering 304 on a matching If-None-Match'''
+    etag, body = entry
+    # The gzipped representation is different bytes, so it needs its own strong validator
+    if responses.compresses(body, event):
+        etag = etag[:-1] + '-gzip"'
+    headers = {
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': 'no-cache',
+        'ETag': etag,
+        'Vary': 'Accept-Encoding'
+    }
+    if_none_match = responses.get_header(event, 'if-none-match')
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return responses.send(304, b'', headers=headers)
+    return responses.send(status, body, event, headers)
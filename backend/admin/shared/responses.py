@@ -0,0 +1,102 @@
+'''
+Response builders shared by all functions.
+
+Payloads are serialized straight to bytes with orjson when it is installed
+(native datetime support, no per-row dict copies of RealDictRow) and with the
+stdlib json module otherwise. Bodies above COMPRESS_MIN_BYTES are gzipped for
+clients that accept it and returned base64-encoded.
+'''
+import base64
+import gzip
+import json
+import os
+import time
+from decimal import Decimal
+from types import MappingProxyType
+
+from shared import instrument
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', '2048'))
+COMPRESS_LEVEL = 5
+
+JSON_HEADERS = MappingProxyType({'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'})
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, memoryview):
+        return bytes(value).decode()
+    return str(value)
+
+def dumps(payload):
+    '''Serialize to UTF-8 JSON bytes'''
+    if not instrument.ENABLED:
+        return _dumps(payload)
+    started = time.perf_counter()
+    try:
+        return _dumps(payload)
+    finally:
+        instrument.add_timing('encode', started)
+
+def _dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode()
+
+def get_header(event, name):
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def accepts_gzip(event):
+    accepted = get_header(event, 'accept-encoding') or ''
+    return 'gzip' in [part.split(';')[0].strip() for part in accepted.split(',')]
+
+def compresses(body, event):
+    '''Whether send() gzips this encoded body (bytes or str) for this request'''
+    size = len(body.encode()) if isinstance(body, str) else len(body)
+    return event is not None and size >= COMPRESS_MIN_BYTES and accepts_gzip(event)
+
+def send(status, body, event=None, headers=None, template=JSON_HEADERS):
+    '''Wrap an encoded body (bytes or str) in the function response shape'''
+    response_headers = dict(template)
+    if headers:
+        response_headers.update(headers)
+    if isinstance(body, str):
+        body = body.encode()
+    if compresses(body, event):
+        response_headers['Content-Encoding'] = 'gzip'
+        response_headers['Vary'] = 'Accept-Encoding'
+        return {
+            'statusCode': status,
+            'headers': response_headers,
+            'body': base64.b64encode(gzip.compress(body, compresslevel=COMPRESS_LEVEL)).decode(),
+            'isBase64Encoded': True
+        }
+    return {'statusCode': status, 'headers': response_headers, 'body': body.decode(), 'isBase64Encoded': False}
+
+def json_response(status, payload, event=None, headers=None):
+    return send(status, dumps(payload), event, headers)
+
+def error(status, message, headers=None):
+    return send(status, dumps({'error': message}), headers=headers)
+
+def preflight(methods, allow_headers):
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Max-Age': '86400'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
@@ -1,8 +1,11 @@
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import db, instrument, ratelimit, responses, tokens
+
+@instrument.handler('auth')
 def handler(event, context):
     '''
     Business: Handle user authentication (register/login)
@@ -12,25 +15,14 @@ def handler(event, context):
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return responses.preflight('GET, POST, OPTIONS', 'Content-Type, X-User-Id')
     
     if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+        return responses.error(405, 'Method not allowed')
+    
+    # Fail before register commits a user it could not hand a token to
+    if not tokens.configured():
+        return responses.error(503, 'Sessions are not configured')
     
     body_data = json.loads(event.get('body', '{}'))
     action = body_data.get('action')
@@ -38,82 +30,43 @@ def handler(event, context):
     password = body_data.get('password', '').strip()
     
     if not username or not password:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Username and password required'}),
-            'isBase64Encoded': False
-        }
+        return responses.error(400, 'Username and password required')
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    limited = ratelimit.check('auth', event)
+    if limited:
+        return limited
     
-    if action == 'register':
-        cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-        existing = cur.fetchone()
+    with db.connection() as conn:
+        cur = db.dict_cursor(conn)
         
-        if existing:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Username already taken'}),
-                'isBase64Encoded': False
-            }
+        if action == 'register':
+            # The unique username constraint decides whether the name is taken, in the same round trip
+            is_verified = username == 'Developer'
+            cur.execute("""
+                INSERT INTO users (username, password, is_verified) VALUES (%s, %s, %s)
+                ON CONFLICT (username) DO NOTHING
+                RETURNING id, username, is_verified, is_banned
+            """, (username, password, is_verified))
+            user = cur.fetchone()
+            
+            if not user:
+                return responses.error(400, 'Username already taken')
+            
+            return responses.json_response(200, {'user': user, 'token': tokens.issue(user)}, event)
         
-        is_verified = username == 'Developer'
-        cur.execute(
-            "INSERT INTO users (username, password, is_verified) VALUES (%s, %s, %s) RETURNING id, username, is_verified, is_banned",
-            (username, password, is_verified)
-        )
-        user = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'user': dict(user)}),
-            'isBase64Encoded': False
-        }
-    
-    elif action == 'login':
-        cur.execute(
-            "SELECT id, username, is_verified, is_banned FROM users WHERE username = %s AND password = %s",
-            (username, password)
-        )
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
+        elif action == 'login':
+            cur.execute(
+                "SELECT id, username, is_verified, is_banned FROM users WHERE username = %s AND password = %s",
+                (username, password)
+            )
+            user = cur.fetchone()
+            
+            if not user:
+                return responses.error(401, 'Invalid credentials')
+            
+            if user['is_banned']:
+                return responses.error(403, 'Account is banned')
+            
+            return responses.json_response(200, {'user': user, 'token': tokens.issue(user)}, event)
         
-        if not user:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid credentials'}),
-                'isBase64Encoded': False
-            }
-        
-        if user['is_banned']:
-            return {
-                'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Account is banned'}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'user': dict(user)}),
-            'isBase64Encoded': False
-        }
-    
-    return {
-        'statusCode': 400,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Invalid action'}),
-        'isBase64Encoded': False
-    }
+        return responses.error(400, 'Invalid action')
@@ -0,0 +1,220 @@
+'''
+Per-request instrumentation shared by all functions.
+
+`@instrument.handler('<function>')` opens a request record for each
+invocation. Pooled connections use a cursor wrapper that adds every
+execute's duration and row count to it; db.connection() adds the time spent
+waiting for a connection and responses.dumps the encode time. On the way out
+the response gets `Server-Timing` and `X-Request-Id` headers and one JSON log
+line is written to stdout. `@instrument.async_handler` does the same for the
+gateway's async handlers, whose pipelines count one round trip for several
+statements.
+
+Statements slower than SLOW_QUERY_MS are logged on their own (SQL text only,
+never parameters), with an `EXPLAIN (FORMAT JSON)` plan for a
+SLOW_QUERY_EXPLAIN_RATE fraction of them.
+
+INSTRUMENT_DISABLED=1 leaves handlers and connections unwrapped.
+'''
+import contextvars
+import functools
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+ENABLED = os.environ.get('INSTRUMENT_DISABLED') != '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', '0'))
+SQL_LOG_CHARS = 2000
+
+_current = contextvars.ContextVar('instrument_request', default=None)
+
+class RequestRecord:
+    __slots__ = ('request_id', 'function', 'started', 'timings', 'queries', 'round_trips', 'rows')
+
+    def __init__(self, request_id, function):
+        self.request_id = request_id
+        self.function = function
+        self.started = time.perf_counter()
+        self.timings = {'db': 0.0, 'connect': 0.0, 'encode': 0.0}
+        self.queries = 0
+        self.round_trips = 0
+        self.rows = 0
+
+def log(record):
+    print(json.dumps(record, default=str, separators=(',', ':')), file=sys.stdout, flush=True)
+
+def add_timing(name, started):
+    '''Add the time since perf_counter() value `started` to the current request'''
+    request = _current.get()
+    if request is not None:
+        request.timings[name] = request.timings.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def add_queries(count, rows, started):
+    '''Add `count` statements sent in one round trip (a pipeline) since `started`'''
+    request = _current.get()
+    if request is not None:
+        request.timings['db'] += (time.perf_counter() - started) * 1000
+        request.queries += count
+        request.round_trips += 1
+        request.rows += rows
+
+def _request_id(event, context):
+    return (
+        (event.get('requestContext') or {}).get('requestId')
+        or getattr(context, 'request_id', None)
+        or uuid.uuid4().hex
+    )
+
+def _finish(request, response):
+    total = (time.perf_counter() - request.started) * 1000
+    headers = dict(response.get('headers') or {})
+    headers['Server-Timing'] = ', '.join([
+        f'db;dur={request.timings["db"]:.1f};desc="{request.queries} queries, {request.round_trips} round trips"',
+        f'connect;dur={request.timings["connect"]:.1f}',
+        f'encode;dur={request.timings["encode"]:.1f}',
+        f'total;dur={total:.1f}'
+    ])
+    headers['X-Request-Id'] = request.request_id
+    exposed = headers.get('Access-Control-Expose-Headers')
+    headers['Access-Control-Expose-Headers'] = (
+        f'{exposed}, Server-Timing, X-Request-Id' if exposed else 'Server-Timing, X-Request-Id'
+    )
+    response['headers'] = headers
+    return response
+
+def _log_request(request, event, status):
+    log({
+        'level': 'info',
+        'request_id': request.request_id,
+        'function': request.function,
+        'method': event.get('httpMethod'),
+        'status': status,
+        'duration_ms': round((time.perf_counter() - request.started) * 1000, 2),
+        'db_ms': round(request.timings['db'], 2),
+        'connect_ms': round(request.timings['connect'], 2),
+        'encode_ms': round(request.timings['encode'], 2),
+        'queries': request.queries,
+        'round_trips': request.round_trips,
+        'rows': request.rows
+    })
+
+def handler(function):
+    '''Decorator for a function's handler(event, context)'''
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(event, context):
+            request = RequestRecord(_request_id(event, context), function)
+            token = _current.set(request)
+            status = 500
+            try:
+                response = fn(event, context)
+                status = response.get('statusCode', 200)
+                return _finish(request, response)
+            finally:
+                _current.reset(token)
+                _log_request(request, event, status)
+        return wrapper
+    return decorate
+
+def async_handler(function):
+    '''Decorator for an async handler(event, context); a None result (not handled) is not logged'''
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(event, context):
+            request = RequestRecord(_request_id(event, context), function)
+            token = _current.set(request)
+            status = 500
+            try:
+                response = await fn(event, context)
+                if response is None:
+                    status = None
+                    return None
+                status = response.get('statusCode', 200)
+                return _finish(request, response)
+            finally:
+                _current.reset(token)
+                if status is not None:
+                    _log_request(request, event, status)
+        return wrapper
+    return decorate
+
+def _explain(cursor, query, vars):
+    import psycopg2
+    import psycopg2.extensions
+    try:
+        # A plain cursor, so the EXPLAIN itself is not instrumented
+        with psycopg2.extensions.cursor(cursor.connection) as cur:
+            cur.execute(b'EXPLAIN (FORMAT JSON) ' + cursor.mogrify(query, vars))
+            return cur.fetchone()[0]
+    except psycopg2.Error as exc:
+        return f'unavailable: {exc}'
+
+def _record_query(cursor, query, vars, started, explain=True):
+    elapsed = (time.perf_counter() - started) * 1000
+    request = _current.get()
+    if request is not None:
+        request.timings['db'] += elapsed
+        request.queries += 1
+        request.round_trips += 1
+        request.rows += max(cursor.rowcount, 0)
+    if elapsed >= SLOW_QUERY_MS:
+        entry = {
+            'level': 'warning',
+            'event': 'slow_query',
+            'request_id': request.request_id if request else None,
+            'function': request.function if request else None,
+            'duration_ms': round(elapsed, 2),
+            'rows': cursor.rowcount,
+            'sql': ' '.join(str(query).split())[:SQL_LOG_CHARS]
+        }
+        if explain and not cursor.name and SLOW_QUERY_EXPLAIN_RATE and random.random() < SLOW_QUERY_EXPLAIN_RATE:
+            entry['plan'] = _explain(cursor, query, vars)
+        log(entry)
+
+_cursor_classes = {}
+
+def _instrumented(base):
+    if base not in _cursor_classes:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    result = super().execute(query, vars)
+                except Exception:
+                    _record_query(self, query, vars, started, explain=False)
+                    raise
+                _record_query(self, query, vars, started)
+                return result
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    _record_query(self, query, None, started, explain=False)
+        _cursor_classes[base] = InstrumentedCursor
+    return _cursor_classes[base]
+
+def connection_factory():
+    '''Connection class for the pool, or None when instrumentation is off'''
+    if not ENABLED:
+        return None
+    import psycopg2.extensions
+
+    class InstrumentedConnection(psycopg2.extensions.connection):
+        def cursor(self, *args, **kwargs):
+            base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs['cursor_factory'] = _instrumented(base)
+            return super().cursor(*args, **kwargs)
+
+    return InstrumentedConnection
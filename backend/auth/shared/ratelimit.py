@@ -0,0 +1,157 @@
+'''
+Token-bucket rate limiting for the write and report paths.
+
+Each limited action has a bucket per client IP (x-forwarded-for) and, when
+the request names one, per user id. A request spends one token (or `cost`,
+e.g. one per report in a batch) from every bucket it maps to, all or nothing; buckets refill continuously up to their
+capacity. Checks run before a handler borrows a database connection, so a
+rejected request costs no round trip.
+
+Buckets live in RATE_LIMIT_URL (falling back to CACHE_URL): `redis://...`
+for a store shared by all containers. With `memory://` or nothing set, each
+container keeps its own buckets, so a client spread over N warm containers
+gets up to N times the limit; deployments with more than one container
+should point it at Redis. Limits are `<capacity>/<seconds>` and can be
+overridden per action, e.g. RATE_LIMIT_COMMENT=20/60.
+'''
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared import responses
+
+# RATE_LIMIT_DISABLED=1 lets every request through (benchmarks, load tests)
+ENABLED = os.environ.get('RATE_LIMIT_DISABLED') != '1'
+
+DEFAULT_LIMITS = {
+    'report': '30/60',
+    'favorite': '120/60',
+    'comment': '10/60',
+    'auth': '10/60'
+}
+
+def parse_limit(value):
+    '''"capacity/seconds" -> (capacity, tokens per second)'''
+    capacity, seconds = value.split('/')
+    return float(capacity), float(capacity) / float(seconds)
+
+LIMITS = {
+    name: parse_limit(os.environ.get(f'RATE_LIMIT_{name.upper()}', default))
+    for name, default in DEFAULT_LIMITS.items()
+}
+
+class MemoryBuckets:
+    '''Per-container buckets (tests, single-process runs, or no RATE_LIMIT_URL)'''
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, keys, capacity, rate, cost=1):
+        '''Spend cost tokens from every bucket, or none; returns seconds to wait (0 if allowed)'''
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key in keys:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+            wait = max([(cost - tokens) / rate for tokens in levels if tokens < cost], default=0)
+            for key, tokens in zip(keys, levels):
+                self._buckets[key] = (tokens if wait else tokens - cost, now)
+                self._buckets.move_to_end(key)
+            # The least recently used buckets have refilled the longest, so dropping them is lenient at worst
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+# Refill, check and spend in one step on the Redis clock, so concurrent
+# containers cannot overspend a bucket
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+local ttl = math.ceil(capacity / rate) + 1
+for i, key in ipairs(KEYS) do
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = tokens - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', key, ttl)
+end
+return tostring(wait)
+"""
+
+class RedisBuckets:
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(TAKE_SCRIPT)
+
+    def take(self, keys, capacity, rate, cost=1):
+        return float(self._take(keys=list(keys), args=[capacity, rate, cost]))
+
+def _store_from_url(url):
+    if not url or url.startswith('memory://'):
+        return MemoryBuckets()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBuckets(url)
+    raise ValueError(f'Unsupported RATE_LIMIT_URL: {url}')
+
+store = _store_from_url(os.environ.get('RATE_LIMIT_URL') or os.environ.get('CACHE_URL'))
+
+def configure(bucket_store):
+    '''Swap the bucket store, e.g. for a fresh MemoryBuckets in tests'''
+    global store
+    store = bucket_store
+
+def client_ip(event):
+    '''First address in x-forwarded-for, as recorded for reports'''
+    return (responses.get_header(event, 'x-forwarded-for') or '0.0.0.0').split(',')[0].strip()
+
+def burst(action):
+    '''Most tokens one request can spend on action, or None when it is not limited'''
+    if not ENABLED or action not in LIMITS:
+        return None
+    return int(LIMITS[action][0])
+
+def check(action, event, user_id=None, cost=1):
+    '''Return a 429 response if the caller is over the limit for action, else None'''
+    if not ENABLED or action not in LIMITS:
+        return None
+    capacity, rate = LIMITS[action]
+    keys = [f'rl:{action}:ip:{client_ip(event)}']
+    if user_id:
+        keys.append(f'rl:{action}:user:{user_id}')
+    try:
+        wait = store.take(keys, capacity, rate, cost)
+    except Exception:
+        # An unreachable limiter store must not take the write paths down with it
+        return None
+    if not wait:
+        return None
+    return responses.error(429, 'Too many requests', headers={
+        'Retry-After': str(max(1, math.ceil(wait))),
+        'Access-Control-Expose-Headers': 'Retry-After'
+    })
@@ -0,0 +1,145 @@
+'''
+Cold versus warm invocation latency for each function, plus an import-time
+profile. Every sample runs in a fresh interpreter, the way a new container does:
+
+    DATABASE_URL=postgresql://localhost/newbin_bench python backend/bench/coldstart.py --runs 10
+    python backend/bench/coldstart.py --importtime pins    # slowest imports of one function
+
+Reported per function (medians): module import, first OPTIONS preflight,
+first real request (cold), and the same request once warm.
+'''
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HANDLERS = ('pins', 'auth', 'actions', 'comments', 'admin')
+WARM_REPEATS = 5
+
+def sample_request(name):
+    if name == 'pins':
+        return {'httpMethod': 'GET', 'queryStringParameters': {'limit': '30'}}
+    if name == 'auth':
+        body = {'action': 'login', 'username': 'coldstart', 'password': 'not-a-password'}
+        return {'httpMethod': 'POST', 'body': json.dumps(body)}
+    if name == 'actions':
+        return {'httpMethod': 'POST', 'body': json.dumps({'action': 'is_favorite', 'user_id': 1, 'pin_id': 1})}
+    if name == 'comments':
+        return {'httpMethod': 'GET', 'queryStringParameters': {'pin_id': '1'}}
+    from shared import tokens
+    token = tokens.issue({'id': 1, 'username': tokens.ADMIN_USERNAME})
+    return {'httpMethod': 'GET', 'headers': {'Authorization': f'Bearer {token}'}, 'queryStringParameters': {}}
+
+def load(name):
+    sys.path.insert(0, BACKEND_DIR)
+    spec = importlib.util.spec_from_file_location(f'coldstart_{name}_index', os.path.join(BACKEND_DIR, name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.handler
+
+def timed(handler, event):
+    started = time.perf_counter()
+    response = handler(event, None)
+    return (time.perf_counter() - started) * 1000, response['statusCode']
+
+def child(name):
+    '''One cold start; prints a JSON sample'''
+    started = time.perf_counter()
+    handler = load(name)
+    import_ms = (time.perf_counter() - started) * 1000
+
+    options_ms, _ = timed(handler, {'httpMethod': 'OPTIONS'})
+    driver_loaded = 'psycopg2' in sys.modules
+    event = sample_request(name)
+    first_ms, status = timed(handler, event)
+    warm = sorted(timed(handler, event)[0] for _ in range(WARM_REPEATS))
+    print(json.dumps({
+        'import_ms': import_ms,
+        'options_ms': options_ms,
+        'first_ms': first_ms,
+        'warm_ms': warm[len(warm) // 2],
+        'status': status,
+        'driver_loaded_by_options': driver_loaded
+    }))
+
+def child_env():
+    env = dict(os.environ)
+    env.update({'CACHE_DISABLED': '1', 'RATE_LIMIT_DISABLED': '1', 'INSTRUMENT_DISABLED': '1'})
+    env.setdefault('SESSION_SECRET', 'coldstart')
+    return env
+
+def measure(name, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', name],
+            env=child_env(), capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    result = {
+        key: statistics.median(sample[key] for sample in samples)
+        for key in ('import_ms', 'options_ms', 'first_ms', 'warm_ms')
+    }
+    result['status'] = samples[-1]['status']
+    result['driver_loaded_by_options'] = any(sample['driver_loaded_by_options'] for sample in samples)
+    return result
+
+def import_profile(name, top):
+    '''Slowest imports (cumulative µs) when loading one function'''
+    # Load the module with nothing else imported first, so shared modules are attributed to it
+    path = os.path.join(BACKEND_DIR, name, 'index.py')
+    code = (
+        f'import sys, importlib.util; sys.path.insert(0, {BACKEND_DIR!r}); '
+        f'spec = importlib.util.spec_from_file_location("index", {path!r}); '
+        f'spec.loader.exec_module(importlib.util.module_from_spec(spec))'
+    )
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], env=child_env(), capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), module.rstrip()))
+    rows.sort(reverse=True)
+    print(f'{"cumulative ms":>13} {"self ms":>8}  module')
+    for cumulative_us, self_us, module in rows[:top]:
+        print(f'{cumulative_us / 1000:>13.2f} {self_us / 1000:>8.2f}  {module}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='cold starts per function')
+    parser.add_argument('--only', help='comma-separated function names')
+    parser.add_argument('--importtime', metavar='FUNCTION', help='print the import profile of one function')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+    if args.importtime:
+        import_profile(args.importtime, args.top)
+        return
+
+    names = args.only.split(',') if args.only else HANDLERS
+    results = {name: measure(name, args.runs) for name in names}
+    print(f'{"function":<10} {"import":>8} {"options":>8} {"cold":>8} {"warm":>8} {"status":>6}  driver@options')
+    for name, r in results.items():
+        print(f"{name:<10} {r['import_ms']:>8.2f} {r['options_ms']:>8.2f} {r['first_ms']:>8.2f} "
+              f"{r['warm_ms']:>8.2f} {r['status']:>6}  {'yes' if r['driver_loaded_by_options'] else 'no'}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'runs': args.runs, 'functions': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Microbenchmark: the old per-handler encode path against shared/responses.
+
+    python backend/bench/encode_bench.py --rows 100 --repeat 2000
+
+Old path: json.dumps({'pins': [dict(p) for p in rows]}, default=str) plus a
+hand-built headers dict. New path: responses.json_response with the shared
+encoder, with and without gzip negotiation.
+'''
+import argparse
+import datetime
+import json
+import os
+import sys
+import timeit
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import responses
+
+try:
+    from psycopg2.extras import RealDictRow
+except ImportError:
+    # Same base class as psycopg2's RealDictRow
+    class RealDictRow(OrderedDict):
+        pass
+
+def make_rows(count, content_length):
+    started = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    rows = []
+    for i in range(count):
+        row = RealDictRow()
+        row.update({
+            'id': i + 1,
+            'title': f'Snippet number {i}',
+            'preview': ('print("hello world")\n' * 20)[:content_length],
+            'content_length': 4000 + i,
+            'author_id': 1 + i % 50,
+            'is_private': False,
+            'tags': ['python', 'example'],
+            'views': i * 37,
+            'comment_count': i % 7,
+            'reports': 0,
+            'created_at': started + datetime.timedelta(minutes=i),
+            'author': f'user{i % 50}',
+            'author_verified': i % 10 == 0
+        })
+        rows.append(row)
+    return rows
+
+def old_path(rows):
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'pins': [dict(p) for p in rows], 'next_cursor': None}, default=str),
+        'isBase64Encoded': False
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--content-length', type=int, default=280)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, args.content_length)
+    plain_event = {'headers': {}}
+    gzip_event = {'headers': {'Accept-Encoding': 'gzip, br'}}
+    cases = {
+        'json.dumps + dict copies': lambda: old_path(rows),
+        'responses.json_response': lambda: responses.json_response(200, {'pins': rows, 'next_cursor': None}, plain_event),
+        'responses.json_response gzip': lambda: responses.json_response(200, {'pins': rows, 'next_cursor': None}, gzip_event),
+    }
+
+    print(f"encoder: {'orjson' if responses.orjson else 'json (orjson not installed)'}, rows: {args.rows}")
+    baseline = None
+    for name, fn in cases.items():
+        per_call = min(timeit.repeat(fn, number=args.repeat, repeat=3)) / args.repeat * 1e6
+        baseline = baseline or per_call
+        size = len(fn()['body'])
+        print(f'{name:<32} {per_call:>9.1f} µs/response {baseline / per_call:>6.2f}x  body {size} bytes')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+'''
+Concurrent HTTP load against a running gateway, to compare the threaded and
+async modes end to end:
+
+    SESSION_SECRET=bench CACHE_DISABLED=1 RATE_LIMIT_DISABLED=1 python backend/gateway/server.py --port 8000
+    SESSION_SECRET=bench python backend/bench/http_load.py --url http://127.0.0.1:8000 --concurrency 64 --output bench_results/threaded.json
+
+    SESSION_SECRET=bench CACHE_DISABLED=1 RATE_LIMIT_DISABLED=1 python backend/gateway/server.py --port 8000 --async
+    SESSION_SECRET=bench python backend/bench/http_load.py --url http://127.0.0.1:8000 --concurrency 64 \\
+        --output bench_results/async.json --compare bench_results/threaded.json
+
+Queries and round trips per request come from the responses' Server-Timing
+header, so leave instrumentation on in the gateway. comments.create signs its
+own session token, so run both with the same SESSION_SECRET.
+'''
+import argparse
+import http.client
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from run import git_revision, percentile
+from shared import tokens
+
+TIMING_RE = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries, (\d+) round trips"')
+
+_local = threading.local()
+
+def request(base, method, path, body=None, extra_headers=None):
+    '''One request on this thread's keep-alive connection; returns (status, Server-Timing)'''
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = http.client.HTTPConnection(base.hostname, base.port or 80, timeout=30)
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    headers.update(extra_headers or {})
+    try:
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        response.read()
+    except (OSError, http.client.HTTPException):
+        conn.close()
+        _local.conn = None
+        raise
+    return response.status, response.getheader('Server-Timing') or ''
+
+def sample_ids(base):
+    '''(pin id, author id) of the newest pin'''
+    conn = http.client.HTTPConnection(base.hostname, base.port or 80, timeout=30)
+    conn.request('GET', '/pins?limit=1')
+    pins = json.loads(conn.getresponse().read())['pins']
+    conn.close()
+    if not pins:
+        sys.exit('no pins: seed the database first (bench/seed.py)')
+    return pins[0]['id'], pins[0]['author_id']
+
+def build_scenarios(pin_id, author_id):
+    comment = {'pin_id': pin_id, 'content': 'http load comment'}
+    session = {'Authorization': f"Bearer {tokens.issue({'id': author_id, 'username': ''})}"}
+    return {
+        'pins.feed.newest': ('GET', '/pins?limit=30', None, None),
+        'pins.feed.trending': ('GET', '/pins?limit=30&sort=trending', None, None),
+        'pins.detail': ('GET', f'/pins?id={pin_id}', None, None),
+        'comments.page': ('GET', f'/comments?pin_id={pin_id}', None, None),
+        'comments.create': ('POST', '/comments', comment, session)
+    }
+
+def run_scenario(base, scenario, requests, concurrency, warmup):
+    method, path, body, headers = scenario
+
+    def invoke(_):
+        started = time.perf_counter()
+        try:
+            status, timing = request(base, method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            return time.perf_counter() - started, 0, 0, False
+        elapsed = time.perf_counter() - started
+        match = TIMING_RE.search(timing)
+        queries, round_trips = (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+        return elapsed, queries, round_trips, status < 400
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(invoke, range(warmup)))
+        wall_started = time.perf_counter()
+        samples = list(executor.map(invoke, range(requests)))
+        wall = time.perf_counter() - wall_started
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    return {
+        'count': len(samples),
+        'errors': sum(1 for sample in samples if not sample[3]),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1],
+        'throughput_rps': len(samples) / wall,
+        'queries_per_request': sum(sample[1] for sample in samples) / len(samples),
+        'round_trips_per_request': sum(sample[2] for sample in samples) / len(samples)
+    }
+
+def print_table(results, baseline=None):
+    header = f"{'scenario':<22} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>9} {'q/req':>6} {'rt/req':>6} {'err':>4}"
+    if baseline:
+        header += f" {'p50 Δ':>8} {'p99 Δ':>8}"
+    print(header)
+    for name, r in results.items():
+        line = (f"{name:<22} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                f"{r['throughput_rps']:>9.1f} {r['queries_per_request']:>6.2f} "
+                f"{r['round_trips_per_request']:>6.2f} {r['errors']:>4}")
+        before = (baseline or {}).get(name)
+        if before:
+            line += f" {r['p50_ms'] / before['p50_ms']:>7.2f}x {r['p99_ms'] / before['p99_ms']:>7.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='gateway base URL')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent keep-alive clients')
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--only', help='comma-separated scenario name prefixes')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    args = parser.parse_args()
+
+    base = urlsplit(args.url)
+    scenarios = build_scenarios(*sample_ids(base))
+    if args.only:
+        prefixes = tuple(args.only.split(','))
+        scenarios = {name: s for name, s in scenarios.items() if name.startswith(prefixes)}
+
+    results = {}
+    for name, scenario in scenarios.items():
+        results[name] = run_scenario(base, scenario, args.requests, args.concurrency, args.warmup)
+        print(f'{name}: p99 {results[name]["p99_ms"]:.2f} ms', file=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['scenarios']
+    print_table(results, baseline)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    'git_revision': git_revision(),
+                    'url': args.url,
+                    'requests': args.requests,
+                    'concurrency': args.concurrency
+                },
+                'scenarios': results
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+'''
+Invoke the function handlers in process against a seeded database and report
+latency percentiles, throughput and queries per request for each scenario.
+
+    DATABASE_URL=postgresql://localhost/newbin_bench \
+        python backend/bench/run.py --iterations 500 --concurrency 8 --output bench_results/before.json
+
+    python backend/bench/run.py --output bench_results/after.json --compare bench_results/before.json
+
+The response cache is disabled unless --with-cache is given, so the numbers
+reflect the database paths.
+'''
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HANDLERS = ('pins', 'auth', 'actions', 'comments', 'admin')
+
+_local = threading.local()
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def count_query():
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+def make_counting_connection():
+    import psycopg2.extensions
+
+    cursor_classes = {}
+
+    def counting(base):
+        if base not in cursor_classes:
+            class CountingCursor(base):
+                def execute(self, query, vars=None):
+                    count_query()
+                    return super().execute(query, vars)
+
+                def executemany(self, query, vars_list):
+                    count_query()
+                    return super().executemany(query, vars_list)
+
+                def copy_expert(self, sql, file, size=8192):
+                    count_query()
+                    return super().copy_expert(sql, file, size)
+            cursor_classes[base] = CountingCursor
+        return cursor_classes[base]
+
+    class CountingConnection(psycopg2.extensions.connection):
+        def cursor(self, *args, **kwargs):
+            base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs['cursor_factory'] = counting(base)
+            return super().cursor(*args, **kwargs)
+
+    return CountingConnection
+
+def load_handlers():
+    handlers = {}
+    for name in HANDLERS:
+        spec = importlib.util.spec_from_file_location(f'bench_{name}_index', os.path.join(BACKEND_DIR, name, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        handlers[name] = module.handler
+    return handlers
+
+def sample_context(db, handlers, deep_pages):
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM pins WHERE reports < 10 AND is_private = false ORDER BY random() LIMIT 1000")
+            pin_ids = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT id FROM users WHERE username LIKE 'bench_user_%' ORDER BY random() LIMIT 1000")
+            user_ids = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT id FROM users WHERE username = 'Developer'")
+            developer = cur.fetchone()
+            cur.execute("SELECT count(*) FROM pins")
+            pin_count = cur.fetchone()[0]
+            cur.execute("SELECT count(*) FROM comments")
+            comment_count = cur.fetchone()[0]
+    if not pin_ids or not user_ids:
+        sys.exit('Database is empty; run backend/bench/seed.py first')
+
+    # Walk the feed to get a cursor deep into it
+    deep_cursor = None
+    for _ in range(deep_pages):
+        params = {'limit': '100'}
+        if deep_cursor:
+            params['cursor'] = deep_cursor
+        response = handlers['pins']({'httpMethod': 'GET', 'queryStringParameters': params}, None)
+        deep_cursor = json.loads(response['body']).get('next_cursor') or deep_cursor
+
+    return {
+        'pin_ids': pin_ids,
+        'user_ids': user_ids,
+        'developer_id': developer[0] if developer else None,
+        'deep_cursor': deep_cursor,
+        'dataset': {'pins': pin_count, 'comments': comment_count}
+    }
+
+def build_scenarios(ctx):
+    from shared import tokens
+    rnd = random.Random(42)
+    pin = lambda: rnd.choice(ctx['pin_ids'])
+    user = lambda: rnd.choice(ctx['user_ids'])
+    # Writes and favorites act as the token's user, so each event signs in as a random one
+    session = lambda: {'Authorization': f"Bearer {tokens.issue({'id': user(), 'username': ''})}"}
+    ip = lambda: {'x-forwarded-for': f'172.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}'}
+    get = lambda params, headers=None: {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': headers or {}}
+    post = lambda body, headers=None: {'httpMethod': 'POST', 'body': json.dumps(body), 'headers': headers or {}}
+
+    scenarios = {
+        'pins.feed_newest': ('pins', lambda: get({})),
+        'pins.feed_deep_page': ('pins', lambda: get({'cursor': ctx['deep_cursor']} if ctx['deep_cursor'] else {})),
+        'pins.feed_views': ('pins', lambda: get({'sort': 'views'})),
+        'pins.feed_personal': ('pins', lambda: get({'user_id': str(user())})),
+        'pins.search': ('pins', lambda: get({'search': rnd.choice(['cache users', 'parse', 'tokens snippet', 'rnder'])})),
+        'pins.detail': ('pins', lambda: get({'id': str(pin())})),
+        'pins.create': ('pins', lambda: post({
+            'title': 'Bench pin', 'content': 'print("bench")\n' * rnd.randint(1, 200),
+            'is_private': False, 'tags': ['bench']
+        }, session())),
+        'comments.list': ('comments', lambda: get({'pin_id': str(pin())})),
+        'comments.create': ('comments', lambda: post({'pin_id': pin(), 'content': 'bench comment'}, session())),
+        'actions.report': ('actions', lambda: post({'action': 'report', 'entity_type': 'pin', 'entity_id': pin()}, ip())),
+        'actions.favorite': ('actions', lambda: post({'action': 'favorite', 'pin_id': pin()}, session())),
+        'actions.get_favorites': ('actions', lambda: post({'action': 'get_favorites'}, session())),
+        'actions.favorite_status': ('actions', lambda: post({
+            'action': 'favorite_status', 'pin_ids': [pin() for _ in range(30)]
+        }, session())),
+        'auth.login': ('auth', lambda: post({'action': 'login', 'username': 'bench_user_1', 'password': 'bench'})),
+    }
+    if ctx['developer_id']:
+        token = tokens.issue({'id': ctx['developer_id'], 'username': tokens.ADMIN_USERNAME})
+        admin = {'Authorization': f'Bearer {token}'}
+        scenarios['admin.list_users'] = ('admin', lambda: get({}, admin))
+        scenarios['admin.search_users'] = ('admin', lambda: get({'search': 'user_12'}, admin))
+    return scenarios
+
+def run_scenario(handler, make_event, iterations, concurrency, warmup):
+    def invoke(_):
+        event = make_event()
+        _local.queries = 0
+        started = time.perf_counter()
+        try:
+            ok = handler(event, None)['statusCode'] < 400
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, _local.queries, ok
+
+    for i in range(warmup):
+        invoke(i)
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(invoke, range(iterations)))
+    wall = time.perf_counter() - wall_started
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    return {
+        'count': len(samples),
+        'errors': sum(1 for sample in samples if not sample[2]),
+        'mean_ms': sum(latencies) / len(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1],
+        'throughput_rps': len(samples) / wall,
+        'queries_per_request': sum(sample[1] for sample in samples) / len(samples)
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results, baseline=None):
+    header = f"{'scenario':<26} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>9} {'q/req':>6} {'err':>4}"
+    if baseline:
+        header += f" {'p50 Δ':>8} {'p99 Δ':>8}"
+    print(header)
+    for name, r in results.items():
+        line = (f"{name:<26} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                f"{r['throughput_rps']:>9.1f} {r['queries_per_request']:>6.2f} {r['errors']:>4}")
+        before = (baseline or {}).get(name)
+        if before:
+            line += f" {r['p50_ms'] / before['p50_ms']:>7.2f}x {r['p99_ms'] / before['p99_ms']:>7.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--deep-pages', type=int, default=20, help='feed pages to walk for the deep-page cursor')
+    parser.add_argument('--only', help='comma-separated scenario name prefixes')
+    parser.add_argument('--with-cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    args = parser.parse_args()
+
+    if not args.with_cache:
+        os.environ['CACHE_DISABLED'] = '1'
+    # The bench drives writes far faster than any client is allowed to
+    os.environ.setdefault('RATE_LIMIT_DISABLED', '1')
+    # The bench counts queries itself; per-request log lines would swamp its output
+    os.environ.setdefault('INSTRUMENT_DISABLED', '1')
+    # Admin scenarios sign their own bearer token
+    os.environ.setdefault('SESSION_SECRET', 'bench')
+    os.environ['DB_POOL_MAX'] = str(max(args.concurrency, int(os.environ.get('DB_POOL_MAX', '5'))))
+    sys.path.insert(0, BACKEND_DIR)
+    from shared import db
+
+    db.get_pool().connection_factory = make_counting_connection()
+    handlers = load_handlers()
+    ctx = sample_context(db, handlers, args.deep_pages)
+    scenarios = build_scenarios(ctx)
+    if args.only:
+        prefixes = tuple(args.only.split(','))
+        scenarios = {name: s for name, s in scenarios.items() if name.startswith(prefixes)}
+
+    results = {}
+    for name, (handler_name, make_event) in scenarios.items():
+        results[name] = run_scenario(handlers[handler_name], make_event, args.iterations, args.concurrency, args.warmup)
+        print(f'{name}: p50 {results[name]["p50_ms"]:.2f} ms', file=sys.stderr)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['scenarios']
+    print_table(results, baseline)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    'git_revision': git_revision(),
+                    'iterations': args.iterations,
+                    'concurrency': args.concurrency,
+                    'cache': args.with_cache,
+                    'dataset': ctx['dataset'],
+                    'pool': db.pool_stats()
+                },
+                'scenarios': results
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+'''
+Create and seed a disposable database for benchmarks.
+
+    DATABASE_URL=postgresql://localhost/newbin_bench \
+        python backend/bench/seed.py --migrate --pins 100000
+
+Everything is generated server-side with generate_series, in batches, so
+seeding 10M pins never holds more than one batch in a transaction.
+'''
+import argparse
+import glob
+import os
+import sys
+import time
+
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'db_migrations')
+BATCH_SIZE = 200000
+
+USERS_SQL = """
+    INSERT INTO users (username, password, is_verified, created_at)
+    SELECT 'bench_user_' || g, 'bench', g %% 50 = 0, now() - g * interval '1 minute'
+    FROM generate_series(%(start)s::bigint, %(stop)s::bigint) g
+    ON CONFLICT (username) DO NOTHING
+"""
+
+PINS_SQL = """
+    INSERT INTO pins (title, content, preview, content_length, author_id, is_private, tags, views, created_at)
+    SELECT title, content, left(content, 280), char_length(content), author_id, is_private, tags, views, created_at
+    FROM (
+        SELECT
+            (ARRAY['Parse', 'Render', 'Fetch', 'Sort', 'Cache', 'Retry'])[1 + g %% 6]
+                || ' ' || (ARRAY['config', 'users', 'tokens', 'images', 'queue'])[1 + g %% 5]
+                || ' snippet ' || g as title,
+            repeat('def handler_' || g || '(event):' || E'\\n    return "' || md5(g::text) || E'"\\n', 1 + g %% 40) as content,
+            %(min_user)s + (g * 7919) %% %(user_count)s as author_id,
+            g %% 20 = 0 as is_private,
+            ARRAY[(ARRAY['python', 'javascript', 'sql', 'go', 'rust', 'bash'])[1 + g %% 6],
+                  (ARRAY['snippet', 'config', 'debug', 'example'])[1 + g %% 4]] as tags,
+            (g * 2654435761) %% 5000 as views,
+            now() - g * interval '10 seconds' as created_at
+        FROM generate_series(%(start)s::bigint, %(stop)s::bigint) g
+    ) generated
+"""
+
+COMMENTS_SQL = """
+    INSERT INTO comments (pin_id, author_id, content, created_at)
+    SELECT %(min_pin)s + (g * 104729) %% %(pin_count)s,
+           %(min_user)s + (g * 7919) %% %(user_count)s,
+           'Comment ' || g || ' ' || md5(g::text),
+           now() - g * interval '3 seconds'
+    FROM generate_series(%(start)s::bigint, %(stop)s::bigint) g
+"""
+
+FAVORITES_SQL = """
+    INSERT INTO favorites (user_id, pin_id)
+    SELECT %(min_user)s + (g * 7919) %% %(user_count)s, %(min_pin)s + (g * 15485863) %% %(pin_count)s
+    FROM generate_series(%(start)s::bigint, %(stop)s::bigint) g
+    ON CONFLICT DO NOTHING
+"""
+
+REPORTS_SQL = """
+    INSERT INTO reports (user_ip, entity_type, entity_id)
+    SELECT '10.' || (g / 65536) %% 256 || '.' || (g / 256) %% 256 || '.' || g %% 256,
+           'pin', %(min_pin)s + (g * 15485863) %% %(pin_count)s
+    FROM generate_series(%(start)s::bigint, %(stop)s::bigint) g
+    ON CONFLICT DO NOTHING
+"""
+
+def apply_migrations(conn):
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+        with open(path) as f:
+            sql = f.read()
+        with conn.cursor() as cur:
+            cur.execute(sql)
+        print(f'applied {os.path.basename(path)}')
+
+def insert_batched(conn, label, sql, total, extra=None):
+    started = time.perf_counter()
+    for start in range(1, total + 1, BATCH_SIZE):
+        stop = min(start + BATCH_SIZE - 1, total)
+        with conn.cursor() as cur:
+            cur.execute(sql, dict(extra or {}, start=start, stop=stop))
+        print(f'\r{label}: {stop}/{total}', end='', file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    print(f'\r{label}: {total} rows in {elapsed:.1f}s', file=sys.stderr)
+
+def id_range(conn, table):
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT min(id), max(id) FROM {table}')
+        low, high = cur.fetchone()
+    return low, high - low + 1
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--migrate', action='store_true', help='apply db_migrations before seeding')
+    parser.add_argument('--pins', type=int, default=10000)
+    parser.add_argument('--users', type=int, help='default: pins / 20')
+    parser.add_argument('--comments-per-pin', type=float, default=3)
+    parser.add_argument('--favorites-per-pin', type=float, default=1)
+    parser.add_argument('--reports', type=int, help='default: pins / 100')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    if args.migrate:
+        apply_migrations(conn)
+
+    users = args.users or max(args.pins // 20, 10)
+    insert_batched(conn, 'users', USERS_SQL, users)
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO users (username, password, is_verified) VALUES ('Developer', 'bench', true) ON CONFLICT DO NOTHING")
+    min_user, user_count = id_range(conn, 'users')
+
+    insert_batched(conn, 'pins', PINS_SQL, args.pins, {'min_user': min_user, 'user_count': user_count})
+    min_pin, pin_count = id_range(conn, 'pins')
+    scope = {'min_user': min_user, 'user_count': user_count, 'min_pin': min_pin, 'pin_count': pin_count}
+
+    insert_batched(conn, 'comments', COMMENTS_SQL, int(args.pins * args.comments_per_pin), scope)
+    insert_batched(conn, 'favorites', FAVORITES_SQL, int(args.pins * args.favorites_per_pin), scope)
+    insert_batched(conn, 'reports', REPORTS_SQL, args.reports if args.reports is not None else args.pins // 100, scope)
+
+    with conn.cursor() as cur:
+        cur.execute('VACUUM ANALYZE')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,63 @@
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import cache, changes, db, instrument, ratelimit, responses, tokens
+from shared.pagination import decode_position, encode_cursor, is_int, is_timestamp, parse_page_size
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Insert, announce on the change feed and read back with the author in one round trip
+INSERT_SQL = f"""
+    WITH inserted AS (
+        INSERT INTO comments (pin_id, author_id, content)
+        VALUES (%s, %s, %s)
+        RETURNING id, pin_id, author_id, content, reports, created_at
+    ), {changes.NOTIFY_COMMENT_CTE}
+    SELECT i.*, u.username as author, u.is_verified as author_verified
+    FROM inserted i
+    JOIN users u ON u.id = i.author_id
+    LEFT JOIN notified ON true
+"""
+
+def comments_page_key(params):
+    limit = parse_page_size(params.get('limit'), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    return cache.namespace_key(cache.comments_namespace(params['pin_id']), limit, params.get('cursor') or '')
+
+def build_page_query(params):
+    '''Return (limit, query, query_params) for a thread page, or None for an invalid cursor'''
+    limit = parse_page_size(params.get('limit'), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    conditions = ['c.pin_id = %s', 'c.reports < 5']
+    query_params = [params['pin_id']]
+    
+    cursor_token = params.get('cursor')
+    if cursor_token:
+        position = decode_position(cursor_token, is_timestamp, is_int)
+        if not position:
+            return None
+        conditions.append('(c.created_at, c.id) < (%s::timestamp, %s)')
+        query_params.extend(position)
+    
+    query = f"""
+        SELECT c.*, u.username as author, u.is_verified as author_verified
+        FROM comments c
+        JOIN users u ON c.author_id = u.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY c.created_at DESC, c.id DESC
+        LIMIT %s
+    """
+    return limit, query, query_params + [limit + 1]
+
+def page_body(comments, limit):
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = encode_cursor(comments[-1]['created_at'].isoformat(), comments[-1]['id'])
+    return responses.dumps({'comments': comments, 'next_cursor': next_cursor})
+
+@instrument.handler('comments')
 def handler(event, context):
     '''
     Business: Handle comments CRUD operations
@@ -12,101 +67,58 @@ def handler(event, context):
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+        return responses.preflight('GET, POST, OPTIONS', 'Content-Type, X-User-Id, Authorization, If-None-Match, X-Read-After')
     
+    read_after = None
     if method == 'GET':
         params = event.get('queryStringParameters') or {}
-        pin_id = params.get('pin_id')
-        
-        if not pin_id:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'pin_id required'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.execute("""
-            SELECT c.*, u.username as author, u.is_verified as author_verified
-            FROM comments c
-            JOIN users u ON c.author_id = u.id
-            WHERE c.pin_id = %s AND c.reports < 5
-            ORDER BY c.created_at DESC
-        """, (pin_id,))
-        
-        comments = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'comments': [dict(c) for c in comments]}, default=str),
-            'isBase64Encoded': False
-        }
+        # A client reading after its own write skips cached pages, which may predate the write
+        read_after = db.read_after(event)
+        entry = cache.get(comments_page_key(params)) if params.get('pin_id') and read_after is None else None
+        if entry:
+            return cache.respond(event, entry)
     
-    elif method == 'POST':
+    if method == 'POST':
+        claims, denied = tokens.require_user(event)
+        if denied:
+            return denied
         body_data = json.loads(event.get('body', '{}'))
-        pin_id = body_data.get('pin_id')
-        author_id = body_data.get('author_id')
-        content = body_data.get('content', '').strip()
-        
-        if not pin_id or not author_id or not content:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Missing required fields'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.execute("""
-            INSERT INTO comments (pin_id, author_id, content)
-            VALUES (%s, %s, %s)
-            RETURNING id, pin_id, author_id, content, reports, created_at
-        """, (pin_id, author_id, content))
-        
-        comment = cur.fetchone()
-        conn.commit()
-        
-        cur.execute("SELECT username, is_verified FROM users WHERE id = %s", (author_id,))
-        user = cur.fetchone()
+        limited = ratelimit.check('comment', event, claims['sub'])
+        if limited:
+            return limited
+    
+    with db.connection(read_only=method == 'GET', min_lsn=read_after) as conn:
+        cur = db.dict_cursor(conn)
         
-        result = dict(comment)
-        result['author'] = user['username']
-        result['author_verified'] = user['is_verified']
+        if method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            pin_id = params.get('pin_id')
+            
+            if not pin_id:
+                return responses.error(400, 'pin_id required')
+            
+            page = build_page_query(params)
+            if not page:
+                return responses.error(400, 'Invalid cursor')
+            limit, query, query_params = page
+            
+            cur.execute(query, query_params)
+            body = page_body(cur.fetchall(), limit)
+            return cache.respond(event, cache.put(comments_page_key(params), body, cache.COMMENTS_TTL))
         
-        cur.close()
-        conn.close()
+        elif method == 'POST':
+            pin_id = body_data.get('pin_id')
+            author_id = claims['sub']
+            content = body_data.get('content', '').strip()
+            
+            if not pin_id or not content:
+                return responses.error(400, 'Missing required fields')
+            
+            cur.execute(INSERT_SQL, (pin_id, author_id, content))
+            comment = cur.fetchone()
+            cache.bump(cache.comments_namespace(pin_id))
+            cache.invalidate(cache.pin_key(pin_id))
+            
+            return responses.json_response(201, {'comment': comment}, event, db.write_token(conn))
         
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'comment': result}, default=str),
-            'isBase64Encoded': False
-        }
-    
-    cur.close()
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+        return responses.error(405, 'Method not allowed')
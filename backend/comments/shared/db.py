@@ -0,0 +1,349 @@
+'''
+Pooled PostgreSQL access shared by all backend functions.
+
+The pool lives at module scope, so a warm container keeps its connections
+between invocations instead of reconnecting on every request. psycopg2 is
+imported on first use, so paths that never touch the database (preflight,
+validation errors) do not pay for loading it on a cold start.
+
+DATABASE_REPLICA_URLS (comma-separated) adds streaming replicas for
+`connection(read_only=True)`. A background thread re-reads each replica's
+replay position and lag every DB_REPLICA_CHECK_INTERVAL seconds, so requests
+only look at the last result. Replicas that fail (on a check or when a
+request connects), were promoted, lag by more than DB_REPLICA_MAX_LAG
+seconds, or have not been checked recently get no reads until a later check
+passes; the read goes to the primary instead. A read carrying a write's LSN
+token (`X-Read-After`) only goes to a replica known to have replayed that
+far, otherwise to the primary.
+'''
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from shared import instrument, responses
+
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', '5'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+# Connections idle for longer than this are pinged before being handed out
+HEALTH_CHECK_AFTER = float(os.environ.get('DB_HEALTH_CHECK_AFTER', '30'))
+
+REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '2'))
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+# A replica that cannot be reached quickly is skipped rather than waited on
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', '2'))
+
+READ_AFTER_HEADER = 'X-Read-After'
+
+REPLICA_STATUS_SQL = """
+    SELECT pg_is_in_recovery() AS in_recovery,
+        pg_last_wal_replay_lsn()::text AS replay_lsn,
+        CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END AS lag_seconds
+"""
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    '''
+    Blocking, thread-safe pool of autocommit connections.
+    Multi-statement writes must run inside `with conn:` to get a transaction.
+    '''
+
+    def __init__(self, dsn, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT, connection_factory=None,
+                 connect_timeout=None):
+        self.dsn = dsn
+        self.connection_factory = connection_factory
+        self.connect_timeout = connect_timeout
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'discarded': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'timeouts': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0
+        }
+
+    def _connect(self):
+        import psycopg2
+        kwargs = {'connect_timeout': self.connect_timeout} if self.connect_timeout else {}
+        conn = psycopg2.connect(self.dsn, connection_factory=self.connection_factory, **kwargs)
+        conn.autocommit = True
+        self._stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since):
+        import psycopg2
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < HEALTH_CHECK_AFTER:
+            return True
+        self._stats['health_checks'] += 1
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            self._stats['health_check_failures'] += 1
+            return False
+
+    def _drop(self, conn):
+        import psycopg2
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+            
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, idle_since):
+                self._drop(conn)
+                continue
+            
+            waited = (time.monotonic() - started) * 1000
+            with self._cond:
+                self._stats['acquired'] += 1
+                self._stats['wait_ms_total'] += waited
+                self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], waited)
+            return conn
+
+    def release(self, conn, discard=False):
+        import psycopg2.extensions
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard or conn.closed:
+            self._drop(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def prefill(self):
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            self.release(conn)
+
+    def stats(self):
+        with self._cond:
+            result = dict(self._stats)
+            result.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max': self.maxconn
+            })
+        return result
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'], connection_factory=instrument.connection_factory())
+    return _pool
+
+def parse_lsn(text):
+    '''pg_lsn text (`16/B374D848`) as an int; None for anything else'''
+    high, sep, low = (text or '').partition('/')
+    try:
+        return (int(high, 16) << 32) + int(low, 16) if sep else None
+    except ValueError:
+        return None
+
+def format_lsn(value):
+    return f'{value >> 32:X}/{value & 0xFFFFFFFF:X}'
+
+class Replica:
+    '''A read-only standby with its own pool and the last known replay position'''
+
+    def __init__(self, dsn):
+        self.pool = ConnectionPool(
+            dsn, minconn=0, connection_factory=instrument.connection_factory(), connect_timeout=REPLICA_CONNECT_TIMEOUT
+        )
+        self.healthy = False
+        self.replay_lsn = 0
+        self.lag_seconds = None
+        self.error = None
+        self.checked_at = None
+
+    def check(self):
+        '''Re-read replay position and lag'''
+        import psycopg2
+        try:
+            conn = self.pool.acquire()
+            broken = False
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(REPLICA_STATUS_SQL)
+                    in_recovery, replay_lsn, lag_seconds = cur.fetchone()
+            except psycopg2.Error:
+                broken = True
+                raise
+            finally:
+                self.pool.release(conn, discard=broken)
+            self.replay_lsn = parse_lsn(replay_lsn) or 0
+            self.lag_seconds = float(lag_seconds)
+            # A promoted standby has left the replication stream and may diverge
+            self.healthy = bool(in_recovery) and self.lag_seconds <= REPLICA_MAX_LAG
+            self.error = None if in_recovery else 'not in recovery'
+        except (psycopg2.Error, PoolTimeout) as exc:
+            self.healthy = False
+            self.error = repr(exc)
+        finally:
+            self.checked_at = time.monotonic()
+
+    def usable(self, min_lsn):
+        # A result older than a few intervals (a container thawed after a freeze,
+        # a stuck check) says nothing about the replica now
+        if self.checked_at is None or time.monotonic() - self.checked_at > REPLICA_CHECK_INTERVAL * 3:
+            return False
+        return self.healthy and (min_lsn is None or self.replay_lsn >= min_lsn)
+
+    def stats(self):
+        return {
+            'healthy': self.healthy,
+            'replay_lsn': format_lsn(self.replay_lsn),
+            'lag_seconds': self.lag_seconds,
+            'error': self.error,
+            'pool': self.pool.stats()
+        }
+
+_replicas = None
+
+def get_replicas():
+    global _replicas
+    if _replicas is None:
+        with _pool_lock:
+            if _replicas is None:
+                _replicas = [Replica(url) for url in REPLICA_URLS]
+                if _replicas:
+                    threading.Thread(target=_check_replicas, args=(_replicas,), name='db-replica-check', daemon=True).start()
+    return _replicas
+
+def _check_replicas(replicas):
+    '''Background loop keeping every replica's status fresh, off the request path'''
+    while True:
+        for replica in replicas:
+            replica.check()
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+def choose_replica(min_lsn=None):
+    '''A usable replica that has replayed min_lsn, or None for the primary'''
+    candidates = [replica for replica in get_replicas() if replica.usable(min_lsn)]
+    return random.choice(candidates) if candidates else None
+
+def read_after(event):
+    '''The LSN token a client got from its last write, if it sent one'''
+    return parse_lsn(responses.get_header(event, READ_AFTER_HEADER)) if REPLICA_URLS else None
+
+def write_token(conn):
+    '''
+    Headers carrying the primary's WAL position after a committed write, so the
+    client's next reads wait for a replica that has it. Empty without replicas.
+    '''
+    if not REPLICA_URLS:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_current_wal_insert_lsn()::text')
+        return {READ_AFTER_HEADER: cur.fetchone()[0], 'Access-Control-Expose-Headers': READ_AFTER_HEADER}
+
+@contextmanager
+def connection(read_only=False, min_lsn=None):
+    '''
+    Borrow a pooled connection; it is returned on every exit path. read_only
+    connections come from a replica when one qualifies (see read_after()).
+    '''
+    import psycopg2
+    replica = choose_replica(min_lsn) if read_only and REPLICA_URLS else None
+    pool = replica.pool if replica else get_pool()
+    started = time.perf_counter()
+    try:
+        conn = pool.acquire()
+    except (psycopg2.Error, PoolTimeout):
+        if not replica:
+            raise
+        # The replica went away since its last check: serve this read from the primary
+        replica.healthy = False
+        replica, pool = None, get_pool()
+        conn = pool.acquire()
+    if instrument.ENABLED:
+        instrument.add_timing('connect', started)
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        if replica:
+            # Keep further reads off it until the next check succeeds
+            replica.healthy = False
+        raise
+    finally:
+        pool.release(conn, discard=broken)
+
+def dict_cursor(conn):
+    '''Cursor returning rows as dicts (RealDictCursor)'''
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor)
+
+def pool_stats():
+    stats = get_pool().stats() if _pool is not None else {'size': 0, 'idle': 0, 'in_use': 0, 'max': POOL_MAX}
+    if REPLICA_URLS:
+        stats['replicas'] = [replica.stats() for replica in get_replicas()]
+    return stats
@@ -0,0 +1,117 @@
+'''
+Async versions of the hottest paths, served by `server.py --async`.
+
+They reuse the SQL and response building of the sync functions but run on
+shared/adb.py, so a request waiting on Postgres holds no thread. Independent
+statements go out in one pipeline: the periodic (small, inline) view flush
+rides along with the pin detail or feed query instead of costing its own round trip. Each
+handler returns None for requests it does not cover, and the gateway hands
+those to the sync handler on the thread pool.
+
+Covered: pins GET (detail and feeds, not ?raw or ?action=tags) and comments
+GET/POST.
+'''
+import json
+
+from shared import adb, cache, instrument, ratelimit, responses, tokens, views
+
+def load(modules):
+    '''Async handlers keyed by function name, built on the loaded function modules'''
+    pins = modules['pins']
+    comments = modules['comments']
+
+    def with_flush(statement):
+        # The flush shares the pipeline; only its side effect matters
+        return [(views.FLUSH_SQL, views.INLINE_FLUSH_PARAMS), statement] if views.due() else [statement]
+
+    @instrument.async_handler('pins')
+    async def pins_handler(event, context):
+        params = event.get('queryStringParameters') or {}
+        if event.get('httpMethod', 'GET') != 'GET' or params.get('raw') or params.get('action'):
+            return None
+        pin_id = params.get('id')
+
+        if pin_id:
+            entry = cache.get(cache.pin_key(pin_id))
+            if entry:
+                async with adb.connection() as conn:
+                    await adb.pipelined(conn, with_flush(("INSERT INTO pin_view_events (pin_id) VALUES (%s)", (pin_id,))))
+                return cache.respond(event, entry)
+
+            async with adb.connection() as conn:
+                rows = (await adb.pipelined(conn, with_flush((pins.DETAIL_SQL, {'pin_id': pin_id}))))[-1]
+            pin = pins.finish_detail(rows[0] if rows else None)
+            if not pin:
+                return responses.error(404, 'Pin not found')
+            body = responses.dumps({'pin': pin})
+            return cache.respond(event, cache.put(cache.pin_key(pin_id), body, cache.PIN_TTL))
+
+        feed_key = pins.feed_cache_key(params)
+        entry = cache.get(feed_key) if feed_key else None
+        if entry:
+            return cache.respond(event, entry)
+
+        feed = pins.build_feed_query(params)
+        if not feed:
+            return responses.error(400, 'Invalid cursor')
+        sort_by, limit, query, query_params = feed
+
+        async with adb.connection() as conn:
+            rows = (await adb.pipelined(conn, with_flush((query, query_params))))[-1]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = pins.encode_feed_cursor(sort_by, rows[-1])
+
+        body = responses.dumps({'pins': rows, 'next_cursor': next_cursor})
+        if feed_key:
+            return cache.respond(event, cache.put(feed_key, body, cache.FEED_TTL))
+        return responses.send(200, body, event)
+
+    @instrument.async_handler('comments')
+    async def comments_handler(event, context):
+        method = event.get('httpMethod', 'GET')
+
+        if method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            if not params.get('pin_id'):
+                return responses.error(400, 'pin_id required')
+            key = comments.comments_page_key(params)
+            entry = cache.get(key)
+            if entry:
+                return cache.respond(event, entry)
+
+            page = comments.build_page_query(params)
+            if not page:
+                return responses.error(400, 'Invalid cursor')
+            limit, query, query_params = page
+
+            async with adb.connection() as conn:
+                rows = await adb.fetch(conn, query, query_params)
+            return cache.respond(event, cache.put(key, comments.page_body(rows, limit), cache.COMMENTS_TTL))
+
+        if method == 'POST':
+            claims, denied = tokens.require_user(event)
+            if denied:
+                return denied
+            body_data = json.loads(event.get('body', '{}'))
+            limited = ratelimit.check('comment', event, claims['sub'])
+            if limited:
+                return limited
+
+            pin_id = body_data.get('pin_id')
+            author_id = claims['sub']
+            content = body_data.get('content', '').strip()
+            if not pin_id or not content:
+                return responses.error(400, 'Missing required fields')
+
+            async with adb.connection() as conn:
+                rows = await adb.fetch(conn, comments.INSERT_SQL, (pin_id, author_id, content))
+            cache.bump(cache.comments_namespace(pin_id))
+            cache.invalidate(cache.pin_key(pin_id))
+            return responses.json_response(201, {'comment': rows[0]}, event)
+
+        return None
+
+    return {'pins': pins_handler, 'comments': comments_handler}
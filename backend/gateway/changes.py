@@ -0,0 +1,290 @@
+'''
+Live change feed served by the gateway at /changes.
+
+    GET /changes?pin_id=42&since=1200     comments on pin 42 after comment 1200
+    GET /changes?since=900                new public pins after pin 900
+
+With `Accept: text/event-stream` the response is a Server-Sent Events stream
+(`id:` is the row id, so a reconnecting EventSource resumes through
+Last-Event-ID). Otherwise it long-polls: the response comes as soon as there
+is anything after `since`, or empty after `timeout` seconds, with
+`next_since` for the next poll. Replays overlap what came before `since` by a
+few seconds (see shared/changes.py), so clients dedupe events by id; within
+one stream the gateway does it for them.
+
+Each process holds one LISTEN connection (a thread on psycopg2, started with
+the first subscriber). Notifications for topics nobody here follows are
+dropped; the rest are loaded in one query per batch and the encoded events
+are shared by every subscriber of the topic.
+'''
+import asyncio
+import json
+import os
+import select
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from shared import changes, db, responses
+
+MAX_SUBSCRIBERS = int(os.environ.get('CHANGES_MAX_SUBSCRIBERS', '10000'))
+LONG_POLL_TIMEOUT = float(os.environ.get('CHANGES_LONG_POLL_TIMEOUT', '25'))
+HEARTBEAT_SECONDS = 15
+# A subscriber further behind than this is sent back to the database to catch up
+QUEUE_MAX = 256
+# Ids a stream remembers having sent, to drop repeats from overlapping catch-ups
+SEEN_MAX = 4096
+RECONNECT_MAX_SECONDS = 30
+
+# Queued instead of events when a subscriber must re-read from the database
+RESYNC = object()
+
+STREAM_HEADERS = {
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    'Access-Control-Allow-Origin': '*'
+}
+
+class Hub:
+    '''Fans the process's LISTEN connection out to subscriber queues'''
+
+    def __init__(self, run_blocking):
+        # run_blocking(fn, *args) -> awaitable, for database work off the event loop
+        self.run_blocking = run_blocking
+        self.topics = {}
+        self.subscribers = 0
+        self.loop = None
+        self.batches = None
+        self.listener = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.batches = asyncio.Queue()
+        self.loop.create_task(self.deliver())
+        self.listener = threading.Thread(target=self.listen, name='changes-listener', daemon=True)
+        self.listener.start()
+
+    def subscribe(self, topic):
+        if self.listener is None:
+            self.start()
+        queue = asyncio.Queue(maxsize=QUEUE_MAX)
+        self.topics.setdefault(topic, set()).add(queue)
+        self.subscribers += 1
+        return queue
+
+    def unsubscribe(self, topic, queue):
+        queues = self.topics.get(topic)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.topics[topic]
+        self.subscribers -= 1
+
+    def listen(self):
+        '''Listener thread: hand each batch of payloads to the event loop; reconnect on failure'''
+        import psycopg2
+        delay = 1
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {changes.CHANNEL}')
+                delay = 1
+                # Anything sent while we were not listening is only in the tables now
+                self.loop.call_soon_threadsafe(self.resync_all)
+                while True:
+                    if select.select([conn], [], [], HEARTBEAT_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    payloads = [notify.payload for notify in conn.notifies]
+                    conn.notifies.clear()
+                    if payloads:
+                        self.loop.call_soon_threadsafe(self.batches.put_nowait, payloads)
+            except Exception as exc:
+                print(json.dumps({'level': 'warning', 'event': 'changes_listener', 'error': repr(exc)}), file=sys.stderr)
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def resync_all(self):
+        for queues in self.topics.values():
+            for queue in queues:
+                self.push(queue, RESYNC)
+
+    def push(self, queue, item):
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+    async def deliver(self):
+        '''Load and fan out notification batches one at a time, so ids reach subscribers in order'''
+        while True:
+            payloads = await self.batches.get()
+            wanted = {}
+            for payload in payloads:
+                parsed = changes.parse(payload)
+                if parsed and parsed[0] in self.topics:
+                    wanted.setdefault(parsed[0], []).append(parsed[1])
+            if not wanted:
+                continue
+            try:
+                events = await self.run_blocking(load_by_id, wanted)
+            except Exception as exc:
+                print(json.dumps({'level': 'warning', 'event': 'changes_load', 'error': repr(exc)}), file=sys.stderr)
+                for topic in wanted:
+                    for queue in self.topics.get(topic, ()):
+                        self.push(queue, RESYNC)
+                continue
+            for event in sorted(events, key=lambda e: e['id']):
+                encoded = (event['id'], event['type'], responses.dumps(event))
+                for queue in self.topics.get(changes.event_topic(event), ()):
+                    self.push(queue, encoded)
+
+    async def catch_up(self, topic, since_id, after):
+        '''One page of missed events and the position to continue from'''
+        events = await self.run_blocking(load_since, topic, since_id, after)
+        batch = [(event['id'], event['type'], responses.dumps(event)) for event in events]
+        return batch, changes.position(events[-1]) if events else after
+
+def load_by_id(wanted):
+    with db.connection() as conn:
+        return changes.by_id(db.dict_cursor(conn), wanted)
+
+def load_since(topic, since_id, after):
+    with db.connection() as conn:
+        return changes.since(db.dict_cursor(conn), topic, since_id, after)
+
+class Seen:
+    '''The last SEEN_MAX event ids sent on a stream'''
+
+    def __init__(self):
+        self.ids = OrderedDict()
+
+    def fresh(self, batch):
+        '''The events of batch not sent before, now remembered'''
+        result = []
+        for item in batch:
+            if item[0] in self.ids:
+                continue
+            self.ids[item[0]] = None
+            result.append(item)
+        while len(self.ids) > SEEN_MAX:
+            self.ids.popitem(last=False)
+        return result
+
+async def follow(hub, topic, since_id):
+    '''
+    Async generator of event batches after since_id (None: from now on); yields
+    [] every HEARTBEAT_SECONDS while idle. Subscribes before reading the
+    backlog, so nothing committed in between is missed. Notifications arrive
+    in commit order, so live events need no ordering, only dedupe against the
+    catch-up.
+    '''
+    queue = hub.subscribe(topic)
+    seen = Seen()
+    try:
+        pending = since_id is not None
+        after = None
+        while True:
+            if pending:
+                batch, after = await hub.catch_up(topic, since_id, after)
+                # A full page means more is waiting
+                pending = len(batch) >= changes.CATCH_UP_LIMIT
+                if not pending:
+                    after = None
+                batch = seen.fresh(batch)
+                if batch:
+                    since_id = batch[-1][0]
+                    yield batch
+                continue
+            try:
+                item = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield []
+                continue
+            if item is RESYNC:
+                # Without a position there is nothing to replay
+                pending = since_id is not None
+                continue
+            if seen.fresh([item]):
+                since_id = item[0]
+                yield [item]
+    finally:
+        hub.unsubscribe(topic, queue)
+
+def parse_since(value):
+    if value in (None, ''):
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return -1
+
+async def sse_frames(batches):
+    try:
+        yield b'retry: 3000\n\n'
+        async for batch in batches:
+            if not batch:
+                yield b': keepalive\n\n'
+                continue
+            yield b''.join(
+                b'id: %d\nevent: %s\ndata: %s\n\n' % (event_id, event_type.encode(), data)
+                for event_id, event_type, data in batch
+            )
+    finally:
+        await batches.aclose()
+
+async def long_poll(batches, since_id, timeout):
+    '''First non-empty batch within timeout, as one JSON body'''
+    deadline = time.monotonic() + timeout
+    events = []
+    try:
+        while not events:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                events = await asyncio.wait_for(batches.__anext__(), remaining)
+            except asyncio.TimeoutError:
+                break
+    finally:
+        await batches.aclose()
+    next_since = events[-1][0] if events else since_id
+    return (
+        b'{"events":[' + b','.join(data for _, _, data in events) + b'],"next_since":'
+        + json.dumps(next_since).encode() + b'}'
+    )
+
+async def respond(hub, event):
+    '''Response dict for the handler-shaped event; an SSE body is an async iterator of chunks'''
+    if event['httpMethod'] == 'OPTIONS':
+        return responses.preflight('GET, OPTIONS', 'Last-Event-ID')
+    if event['httpMethod'] != 'GET':
+        return responses.error(405, 'Method not allowed')
+    params = event['queryStringParameters']
+    topic = changes.topic_for(params)
+    if topic is None:
+        return responses.error(400, 'Invalid pin_id')
+    since_id = parse_since(params.get('since') or responses.get_header(event, 'last-event-id'))
+    if since_id == -1:
+        return responses.error(400, 'Invalid since')
+    if hub.subscribers >= MAX_SUBSCRIBERS:
+        return responses.error(503, 'Too many subscribers', headers={'Retry-After': '5'})
+
+    batches = follow(hub, topic, since_id)
+    if 'text/event-stream' in (responses.get_header(event, 'accept') or ''):
+        return {'statusCode': 200, 'headers': dict(STREAM_HEADERS), 'body': sse_frames(batches)}
+    try:
+        timeout = min(float(params.get('timeout', LONG_POLL_TIMEOUT)), LONG_POLL_TIMEOUT)
+    except ValueError:
+        timeout = LONG_POLL_TIMEOUT
+    body = await long_poll(batches, since_id, max(timeout, 0))
+    return {'statusCode': 200, 'headers': dict(responses.JSON_HEADERS, **{'Cache-Control': 'no-store'}), 'body': body}
@@ -0,0 +1,327 @@
+'''
+Local gateway: all five functions behind one HTTP server.
+
+Requests to /<function>[/...] are translated into the cloud function `event`
+shape and run on a bounded thread pool, so the handlers share one module-level
+connection pool (size it with DB_POOL_MAX >= GATEWAY_THREADS).
+
+    python backend/gateway/server.py --port 8000                 # single process
+    python backend/gateway/server.py --port 8000 --workers 4     # one pool per worker
+
+With --async (or GATEWAY_ASYNC=1) the paths in gateway/async_handlers.py run
+on the event loop over an async pool and everything else stays on the threads.
+
+/changes is the live change feed (gateway/changes.py): new comments on a pin
+and new pins, over Server-Sent Events or long-poll.
+
+`app` is a plain ASGI application. When uvicorn is installed it serves it
+(and runs the workers); otherwise a minimal asyncio HTTP/1.1 server does,
+forking workers that share the port through SO_REUSEPORT.
+'''
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FUNCTIONS = ('pins', 'auth', 'actions', 'comments', 'admin')
+
+THREADS = int(os.environ.get('GATEWAY_THREADS', '8'))
+# Requests beyond this many in flight are turned away instead of queueing without bound
+MAX_PENDING = int(os.environ.get('GATEWAY_MAX_PENDING', str(THREADS * 8)))
+MAX_BODY_BYTES = int(os.environ.get('GATEWAY_MAX_BODY_BYTES', str(16 * 1024 * 1024)))
+ASYNC = os.environ.get('GATEWAY_ASYNC') == '1'
+
+# The handlers size their pool from the environment at import time
+os.environ.setdefault('DB_POOL_MAX', str(THREADS))
+sys.path.insert(0, BACKEND_DIR)
+from gateway import changes
+from shared import db, responses
+
+class Context:
+    '''Stand-in for the platform's invocation context'''
+
+    def __init__(self, function_name, request_id):
+        self.function_name = function_name
+        self.request_id = request_id
+        self.deadline = time.monotonic() + 30
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+def load_modules():
+    modules = {}
+    for name in FUNCTIONS:
+        spec = importlib.util.spec_from_file_location(f'gateway_{name}_index', os.path.join(BACKEND_DIR, name, 'index.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        modules[name] = module
+    return modules
+
+modules = load_modules()
+handlers = {name: module.handler for name, module in modules.items()}
+if ASYNC:
+    from gateway.async_handlers import load as load_async_handlers
+    from shared import adb
+    async_handlers = load_async_handlers(modules)
+else:
+    async_handlers = {}
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='gateway')
+hub = changes.Hub(lambda fn, *args: asyncio.get_running_loop().run_in_executor(executor, fn, *args))
+_pending = 0
+
+def build_event(method, path, query_string, headers, body, client_ip):
+    '''Translate an HTTP request into the event dict the handlers expect'''
+    headers = dict(headers)
+    if client_ip and 'x-forwarded-for' not in headers:
+        headers['x-forwarded-for'] = client_ip
+    try:
+        text, is_base64 = body.decode(), False
+    except UnicodeDecodeError:
+        text, is_base64 = base64.b64encode(body).decode(), True
+    return {
+        'httpMethod': method,
+        'path': path,
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(query_string, keep_blank_values=True)),
+        'body': text,
+        'isBase64Encoded': is_base64,
+        'requestContext': {'requestId': str(uuid.uuid4()), 'identity': {'sourceIp': client_ip}}
+    }
+
+def failed(name, exc):
+    if isinstance(exc, db.PoolTimeout):
+        return responses.error(503, 'Database busy', headers={'Retry-After': '1'})
+    print(json.dumps({'level': 'error', 'function': name, 'error': repr(exc)}), file=sys.stderr)
+    return responses.error(500, 'Internal server error')
+
+def invoke(name, event):
+    '''Run a handler and return (status, [(header, value)], body bytes)'''
+    try:
+        result = handlers[name](event, Context(name, event['requestContext']['requestId']))
+    except Exception as exc:
+        result = failed(name, exc)
+    return encode(result)
+
+async def invoke_async(name, event):
+    '''Like invoke() for an async handler; None when it leaves the request to the sync one'''
+    try:
+        result = await async_handlers[name](event, Context(name, event['requestContext']['requestId']))
+    except Exception as exc:
+        result = failed(name, exc)
+    return encode(result) if result is not None else None
+
+def encode(result):
+    body = result.get('body') or ''
+    if result.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode()
+    headers = [(key, str(value)) for key, value in (result.get('headers') or {}).items()]
+    return result.get('statusCode', 200), headers, body
+
+def route(path):
+    name = path.strip('/').split('/', 1)[0]
+    return name if name in handlers else None
+
+async def dispatch(method, path, query_string, headers, body, client_ip):
+    '''(status, headers, body); body is bytes, or an async iterator of chunks for a stream'''
+    global _pending
+    if path.strip('/').split('/', 1)[0] == 'changes':
+        # Subscribers wait on the event loop, so they are capped by the hub rather than MAX_PENDING
+        return encode(await changes.respond(hub, build_event(method, path, query_string, headers, body, client_ip)))
+    name = route(path)
+    if name is None:
+        return 404, [('Content-Type', 'application/json')], b'{"error":"Not found"}'
+    if _pending >= MAX_PENDING:
+        return 503, [('Content-Type', 'application/json'), ('Retry-After', '1')], b'{"error":"Server busy"}'
+    _pending += 1
+    try:
+        event = build_event(method, path, query_string, headers, body, client_ip)
+        if name in async_handlers:
+            response = await invoke_async(name, event)
+            if response is not None:
+                return response
+        return await asyncio.get_running_loop().run_in_executor(executor, invoke, name, event)
+    finally:
+        _pending -= 1
+
+async def app(scope, receive, send):
+    '''ASGI entry point'''
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                executor.shutdown(wait=False)
+                if ASYNC:
+                    await adb.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    headers = [(key.decode('latin-1').lower(), value.decode('latin-1')) for key, value in scope['headers']]
+    client = scope.get('client')
+    status, response_headers, response_body = await dispatch(
+        scope['method'], scope['path'], scope.get('query_string', b'').decode('latin-1'),
+        headers, bytes(body), client[0] if client else None
+    )
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(key.encode('latin-1'), value.encode('latin-1')) for key, value in response_headers]
+    })
+    if isinstance(response_body, bytes):
+        await send({'type': 'http.response.body', 'body': response_body})
+        return
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        async for chunk in response_body:
+            if watcher.done():
+                return
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        watcher.cancel()
+        await response_body.aclose()
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def serve_connection(reader, writer):
+    '''Minimal HTTP/1.1 with keep-alive; request bodies need Content-Length'''
+    peer = writer.get_extra_info('peername')
+    client_ip = peer[0] if peer else None
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                return
+            method, target, version = request_line.decode('latin-1').split()
+            headers = []
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                key, _, value = line.partition(':')
+                headers.append((key.strip().lower(), value.strip()))
+            header_map = dict(headers)
+            length = int(header_map.get('content-length') or 0)
+            if length > MAX_BODY_BYTES:
+                writer.write(b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            body = await reader.readexactly(length) if length else b''
+            path, _, query_string = target.partition('?')
+            status, response_headers, response_body = await dispatch(method, path, query_string, headers, body, client_ip)
+
+            keep_alive = header_map.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+            head = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+            head += [f'{key}: {value}' for key, value in response_headers if key.lower() != 'content-length']
+            if not isinstance(response_body, bytes):
+                await write_stream(writer, head, response_body)
+                return
+            head.append(f'Content-Length: {len(response_body)}')
+            head.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response_body)
+            await writer.drain()
+            if not keep_alive:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        return
+    finally:
+        writer.close()
+
+async def write_stream(writer, head, chunks):
+    '''Chunked response that ends the connection; a write to a closed socket ends the stream'''
+    head += ['Transfer-Encoding: chunked', 'Connection: close']
+    try:
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        async for chunk in chunks:
+            writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+    finally:
+        await chunks.aclose()
+
+def listen(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+async def serve(host, port):
+    server = await asyncio.start_server(serve_connection, sock=listen(host, port))
+    async with server:
+        await server.serve_forever()
+
+def run_builtin(host, port, workers):
+    if workers <= 1:
+        asyncio.run(serve(host, port))
+        return
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Each worker opens its own database connections lazily, after the fork
+            asyncio.run(serve(host, port))
+            os._exit(0)
+        children.append(pid)
+    signal.signal(signal.SIGTERM, lambda *_: [os.kill(pid, signal.SIGTERM) for pid in children])
+    for pid in children:
+        os.waitpid(pid, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve all backend functions from one process')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help='serve the covered paths from async handlers (same as GATEWAY_ASYNC=1)')
+    args = parser.parse_args()
+    if args.async_mode and not ASYNC:
+        # Handlers are loaded at import, so re-exec with the switch in the environment (uvicorn workers inherit it)
+        os.environ['GATEWAY_ASYNC'] = '1'
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    print(f'gateway on http://{args.host}:{args.port}/{{{",".join(FUNCTIONS)}}} '
+          f'({args.workers} worker(s), {THREADS} threads each{", async" if ASYNC else ""})')
+    try:
+        import uvicorn
+    except ImportError:
+        run_builtin(args.host, args.port, args.workers)
+        return
+    if args.workers <= 1:
+        # Serve the app built by this module; an import string would make uvicorn
+        # import gateway.server a second time, beside __main__, with its own handlers and pools
+        uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+        return
+    # Worker processes need an import string; each builds its own app and pools
+    uvicorn.run('gateway.server:app', app_dir=BACKEND_DIR, host=args.host, port=args.port,
+                workers=args.workers, log_level='warning')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+'''
+Coalesce pin_view_events into pins.views on a fixed interval.
+Run once per deployment (cron or a long-lived process):
+
+    python backend/jobs/flush_views.py            # loop forever
+    python backend/jobs/flush_views.py --once     # single flush
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import db, views
+
+def main():
+    once = '--once' in sys.argv[1:]
+    while True:
+        with db.connection() as conn:
+            drained = views.flush(conn)
+            # Keep draining while a backlog remains
+            while drained and not once:
+                drained = views.flush(conn)
+        if once:
+            return
+        time.sleep(views.FLUSH_INTERVAL)
+
+if __name__ == '__main__':
+    main()
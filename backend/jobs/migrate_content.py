@@ -0,0 +1,65 @@
+'''
+Move inline pins.content into pin_contents (deduplicated and compressed).
+Safe to re-run; only pins without a content_hash are touched:
+
+    python backend/jobs/migrate_content.py                 # migrate everything
+    python backend/jobs/migrate_content.py --batch 200     # smaller transactions
+
+Run VACUUM (or let autovacuum catch up) on pins afterwards to reclaim the
+space held by the old inline bodies.
+'''
+import argparse
+import os
+import sys
+
+from psycopg2.extras import execute_values
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import content_store, db
+
+def migrate_batch(conn, batch):
+    rows = [(pin_id, content_store.prepare(content)) for pin_id, content in batch]
+    with conn, conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO pin_contents (hash, codec, body, size) VALUES %s
+            ON CONFLICT (hash) DO NOTHING
+        """, [(p['content_hash'], p['content_codec'], p['content_body'], p['content_size']) for _, p in rows])
+        # content IS NOT NULL guards against a concurrent edit having migrated the row already
+        execute_values(cur, """
+            UPDATE pins SET content_hash = v.hash, content = NULL
+            FROM (VALUES %s) AS v(id, hash)
+            WHERE pins.id = v.id AND pins.content IS NOT NULL
+        """, [(pin_id, p['content_hash']) for pin_id, p in rows])
+
+def main():
+    parser = argparse.ArgumentParser(description='Move pin bodies into pin_contents')
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    migrated = 0
+    # Reading and writing use separate connections: the named (server-side) cursor
+    # needs a transaction that stays open across the batch commits
+    with db.connection() as reader, db.connection() as writer:
+        reader.autocommit = False
+        try:
+            with reader.cursor(name='migrate_content') as cur:
+                cur.itersize = args.batch
+                cur.execute("""
+                    SELECT id, content FROM pins
+                    WHERE content_hash IS NULL AND content IS NOT NULL
+                    ORDER BY id
+                """)
+                while True:
+                    batch = cur.fetchmany(args.batch)
+                    if not batch:
+                        break
+                    migrate_batch(writer, batch)
+                    migrated += len(batch)
+                    print(f'migrated {migrated} pins')
+        finally:
+            reader.rollback()
+            reader.autocommit = True
+    print(f'done: {migrated} pins moved to pin_contents')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+'''
+Bulk export and import of pins as NDJSON (one JSON object per line).
+
+    python backend/jobs/pins_ndjson.py export > pins.ndjson
+    python backend/jobs/pins_ndjson.py export --include-hidden --output pins.ndjson
+    python backend/jobs/pins_ndjson.py import pins.ndjson --rejects rejected.ndjson
+    cat pins.ndjson | python backend/jobs/pins_ndjson.py import -
+
+Export streams from a server-side cursor. Import works in batches: each batch
+is validated (authors resolved with one query), COPYed into a temporary table
+and moved into pin_contents and pins with one statement, then committed.
+Memory stays bounded by --batch either way.
+
+Records: {"title", "content", "author" (username) or "author_id",
+"is_private", "tags", "created_at"}; export also writes "id" and "views",
+which import ignores. Invalid records go to --rejects with a reason.
+'''
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# Export writes to stdout, which the request log and slow-query log also use
+os.environ.setdefault('INSTRUMENT_DISABLED', '1')
+from shared import cache, content_store, db, responses
+
+TITLE_MAX_LENGTH = 255
+
+STAGING_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS pin_import (
+        title TEXT,
+        content TEXT,
+        content_hash CHAR(64),
+        content_codec VARCHAR(10),
+        content_body BYTEA,
+        content_size INTEGER,
+        author_id INTEGER,
+        is_private BOOLEAN,
+        tags TEXT[],
+        created_at TIMESTAMP
+    ) ON COMMIT DELETE ROWS
+"""
+
+COPY_SQL = """
+    COPY pin_import (title, content, content_hash, content_codec, content_body, content_size,
+        author_id, is_private, tags, created_at)
+    FROM STDIN WITH (FORMAT csv)
+"""
+
+# Same shape as pins POST: body in pin_contents, content lexemes supplied for search
+MOVE_SQL = f"""
+    WITH stored AS (
+        INSERT INTO pin_contents (hash, codec, body, size)
+        SELECT DISTINCT ON (content_hash) content_hash, content_codec, content_body, content_size
+        FROM pin_import
+        ORDER BY content_hash
+        ON CONFLICT (hash) DO NOTHING
+    )
+    INSERT INTO pins (title, content_hash, preview, content_length, author_id, is_private, tags,
+        search_vector, created_at)
+    SELECT title, content_hash, left(content, {content_store.PREVIEW_LENGTH}), char_length(content), author_id,
+        is_private, tags, setweight(to_tsvector('simple', left(content, 100000)), 'C'),
+        coalesce(created_at, CURRENT_TIMESTAMP)
+    FROM pin_import
+"""
+
+def array_literal(values):
+    '''Postgres text[] literal with every element quoted'''
+    return '{' + ','.join('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values) + '}'
+
+def validate(record):
+    '''Return (fields, None) for a well-formed record, else (None, reason); authors are resolved later'''
+    if not isinstance(record, dict):
+        return None, 'not an object'
+    title = record.get('title')
+    content = record.get('content')
+    if not isinstance(title, str) or not title.strip():
+        return None, 'title required'
+    if len(title.strip()) > TITLE_MAX_LENGTH:
+        return None, f'title longer than {TITLE_MAX_LENGTH}'
+    if not isinstance(content, str) or not content.strip():
+        return None, 'content required'
+    tags = record.get('tags') or []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) and tag for tag in tags):
+        return None, 'tags must be a list of non-empty strings'
+    is_private = record.get('is_private', False)
+    if not isinstance(is_private, bool):
+        return None, 'is_private must be a boolean'
+    created_at = record.get('created_at')
+    if created_at is not None:
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            return None, 'created_at must be an ISO timestamp'
+    author = record.get('author_id', record.get('author'))
+    if isinstance(author, bool) or not isinstance(author, (int, str)) or author == '':
+        return None, 'author or author_id required'
+    return {
+        'title': title.strip(),
+        'content': content.strip(),
+        'author': author,
+        'is_private': is_private,
+        'tags': tags,
+        'created_at': created_at
+    }, None
+
+def resolve_authors(cur, pending):
+    '''Map each author id/username in the batch to a users.id with one query'''
+    ids = sorted({p['author'] for p in pending if isinstance(p['author'], int)})
+    names = sorted({p['author'] for p in pending if isinstance(p['author'], str)})
+    cur.execute(
+        "SELECT id, username FROM users WHERE (id = ANY(%s) OR username = ANY(%s)) AND NOT coalesce(is_banned, false)",
+        (ids, names)
+    )
+    found = {}
+    for user_id, username in cur.fetchall():
+        found[user_id] = user_id
+        found[username] = user_id
+    return found
+
+def import_batch(conn, batch, rejects):
+    '''Load one batch of (line_number, record); returns the number of pins inserted'''
+    pending = []
+    for line_number, record in batch:
+        fields, reason = validate(record)
+        if reason:
+            rejects(line_number, record, reason)
+        else:
+            pending.append((line_number, record, fields))
+    if not pending:
+        return 0
+
+    with conn:
+        with conn.cursor() as cur:
+            authors = resolve_authors(cur, [fields for _, _, fields in pending])
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            rows = 0
+            for line_number, record, fields in pending:
+                author_id = authors.get(fields['author'])
+                if author_id is None:
+                    rejects(line_number, record, 'unknown or banned author')
+                    continue
+                stored = content_store.prepare(fields['content'])
+                writer.writerow([
+                    fields['title'],
+                    fields['content'],
+                    stored['content_hash'],
+                    stored['content_codec'],
+                    '\\x' + stored['content_body'].hex(),
+                    stored['content_size'],
+                    author_id,
+                    't' if fields['is_private'] else 'f',
+                    array_literal(fields['tags']),
+                    fields['created_at'].isoformat() if fields['created_at'] else ''
+                ])
+                rows += 1
+            if not rows:
+                return 0
+            buffer.seek(0)
+            cur.copy_expert(COPY_SQL, buffer)
+            cur.execute(MOVE_SQL)
+            return cur.rowcount
+
+def run_import(source, batch_size, rejects_path):
+    rejected = 0
+    rejects_file = open(rejects_path, 'w') if rejects_path else None
+
+    def rejects(line_number, record, reason):
+        nonlocal rejected
+        rejected += 1
+        if rejects_file:
+            rejects_file.write(json.dumps({'line': line_number, 'reason': reason, 'record': record}) + '\n')
+
+    inserted = 0
+    started = time.monotonic()
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(STAGING_TABLE)
+            batch = []
+            for line_number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append((line_number, json.loads(line)))
+                except ValueError:
+                    rejects(line_number, line.strip()[:200], 'invalid JSON')
+                    continue
+                if len(batch) >= batch_size:
+                    inserted += import_batch(conn, batch, rejects)
+                    batch = []
+                    report('imported', inserted, started)
+            if batch:
+                inserted += import_batch(conn, batch, rejects)
+    finally:
+        if rejects_file:
+            rejects_file.close()
+    if inserted:
+        cache.bump('feed')
+    report('imported', inserted, started, final=True)
+    print(f'rejected {rejected} records', file=sys.stderr)
+
+def run_export(out, batch_size, include_hidden):
+    exported = 0
+    started = time.monotonic()
+    with db.connection() as conn:
+        # Named cursors need a transaction; it stays read-only
+        conn.autocommit = False
+        try:
+            with conn.cursor(name='export_pins') as cur:
+                cur.itersize = batch_size
+                cur.execute(f"""
+                    SELECT p.id, p.title, p.content, c.codec, c.body, u.username, p.is_private, p.tags,
+                        p.views, p.created_at
+                    FROM pins p
+                    JOIN users u ON u.id = p.author_id
+                    LEFT JOIN pin_contents c ON c.hash = p.content_hash
+                    {'' if include_hidden else 'WHERE p.reports < 10'}
+                    ORDER BY p.id
+                """)
+                for pin_id, title, content, codec, body, username, is_private, tags, views, created_at in cur:
+                    if content is None and codec:
+                        content = content_store.decompress(codec, body).decode()
+                    out.write(responses.dumps({
+                        'id': pin_id,
+                        'title': title,
+                        'content': content,
+                        'author': username,
+                        'is_private': is_private,
+                        'tags': tags or [],
+                        'views': views,
+                        'created_at': created_at
+                    }) + b'\n')
+                    exported += 1
+                    if exported % batch_size == 0:
+                        report('exported', exported, started)
+        finally:
+            conn.rollback()
+            conn.autocommit = True
+    report('exported', exported, started, final=True)
+
+def report(verb, count, started, final=False):
+    elapsed = max(time.monotonic() - started, 1e-9)
+    print(f'{"done: " if final else ""}{verb} {count} pins, {count / elapsed:.0f} rows/s', file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('--output', help='file to write (default stdout)')
+    export_parser.add_argument('--include-hidden', action='store_true', help='also export reported-away pins')
+    export_parser.add_argument('--batch', type=int, default=2000)
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('source', help="NDJSON file, or - for stdin")
+    import_parser.add_argument('--rejects', help='write rejected records here as NDJSON')
+    import_parser.add_argument('--batch', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        if args.output:
+            with open(args.output, 'wb') as out:
+                run_export(out, args.batch, args.include_hidden)
+        else:
+            run_export(sys.stdout.buffer, args.batch, args.include_hidden)
+    elif args.source == '-':
+        run_import(sys.stdin, args.batch, args.rejects)
+    else:
+        with open(args.source, encoding='utf-8') as source:
+            run_import(source, args.batch, args.rejects)
+
+if __name__ == '__main__':
+    main()
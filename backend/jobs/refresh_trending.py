@@ -0,0 +1,26 @@
+'''
+Keep pins.trending_score current for the `trending` feed sort.
+Run once per deployment (cron or a long-lived process):
+
+    python backend/jobs/refresh_trending.py            # loop forever
+    python backend/jobs/refresh_trending.py --once     # drain the dirty set once
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import db, trending
+
+def main():
+    once = '--once' in sys.argv[1:]
+    while True:
+        with db.connection() as conn:
+            while trending.refresh(conn) >= trending.REFRESH_BATCH:
+                pass
+        if once:
+            return
+        time.sleep(trending.REFRESH_INTERVAL)
+
+if __name__ == '__main__':
+    main()
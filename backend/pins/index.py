@@ -1,180 +1,451 @@
+import base64
+import gzip
+import importlib.util
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import re
+import sys
 
-def handler(event, context):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from shared import cache, changes, content_store, db, instrument, responses, tokens, views
+from shared.pagination import decode_position, encode_cursor, is_int, is_number, is_timestamp, parse_page_size
+from shared.params import escape_like
+
+# brotli is only imported when a raw response is brotli-encoded
+BROTLI_AVAILABLE = importlib.util.find_spec('brotli') is not None
+
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+DEFAULT_TAG_LIMIT = 50
+MAX_TAG_LIMIT = 200
+
+# Feed rows carry a bounded preview; full content is only served by the detail endpoint
+FEED_COLUMNS = (
+    'p.id, p.title, p.preview, p.content_length, p.author_id, p.is_private, p.tags, '
+    'p.views, p.comment_count, p.reports, p.created_at'
+)
+
+# sort mode -> (keyset columns, key type, ORDER BY clause, keyset comparison operator)
+FEED_SORTS = {
+    'newest': ('(p.created_at, p.id)', 'timestamp', 'p.created_at DESC, p.id DESC', '<'),
+    'oldest': ('(p.created_at, p.id)', 'timestamp', 'p.created_at ASC, p.id ASC', '>'),
+    'views': ('(p.views, p.id)', 'integer', 'p.views DESC, p.id DESC', '<'),
+    'trending': ('(p.trending_score, p.id)', 'float8', 'p.trending_score DESC, p.id DESC', '<'),
+    'relevance': ('(rank, id)', 'float8', 'rank DESC, id DESC', '<')
+}
+
+RAW_COMPRESS_MIN_BYTES = 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+SEARCH_QUERY = "websearch_to_tsquery('simple', %(search)s)"
+
+# Log the view and read the pin in one statement; the new event is not
+# visible to the outer SELECT, hence the count over `viewed`
+DETAIL_SQL = """
+    WITH viewed AS (
+        INSERT INTO pin_view_events (pin_id)
+        SELECT id FROM pins WHERE id = %(pin_id)s AND reports < 10
+        RETURNING pin_id
+    )
+    SELECT p.id, p.title, p.content, p.author_id, p.is_private, p.tags, p.comment_count,
+        p.reports, p.created_at, p.updated_at, u.username as author, u.is_verified as author_verified,
+        p.views
+            + (SELECT count(*) FROM pin_view_events e WHERE e.pin_id = p.id)
+            + (SELECT count(*) FROM viewed) as views,
+        c.codec as content_codec, c.body as content_body
+    FROM pins p
+    JOIN users u ON p.author_id = u.id
+    LEFT JOIN pin_contents c ON c.hash = p.content_hash
+    WHERE p.id = %(pin_id)s AND p.reports < 10
+"""
+
+def encode_feed_cursor(sort_by, row):
+    '''Pack the sort key and id of the last row into an opaque token'''
+    if sort_by == 'views':
+        key = row['views']
+    elif sort_by == 'relevance':
+        key = row['rank']
+    elif sort_by == 'trending':
+        key = row['trending_score']
+    else:
+        key = row['created_at'].isoformat()
+    return encode_cursor(sort_by, key, row['id'])
+
+def decode_feed_cursor(token, sort_by):
+    '''Return (key, id) from a token issued for the same sort mode, or None if invalid'''
+    is_key = {'views': is_int, 'relevance': is_number, 'trending': is_number}.get(sort_by, is_timestamp)
+    values = decode_position(token, lambda cursor_sort: cursor_sort == sort_by, is_key, is_int)
+    if not values:
+        return None
+    return values[1], values[2]
+
+def parse_range(header, size):
+    '''Return (start, end) inclusive for a single byte range, None to serve the whole body, or False if unsatisfiable'''
+    match = RANGE_RE.match((header or '').replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, min(int(last), size - 1) if last else size - 1
+
+def negotiate_encoding(event):
+    accepted = [part.split(';')[0].strip() for part in (responses.get_header(event, 'accept-encoding') or '').split(',')]
+    if BROTLI_AVAILABLE and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def migrate_inline(pin_id, content):
     '''
-    Business: Handle pins CRUD operations
-    Args: event with httpMethod, body, queryStringParameters
-    Returns: HTTP response with pins data
+    Move a pin's inline content into pin_contents on its first raw read, so later
+    reads (and their conditional requests) never touch the inline body. Returns
+    the stored metadata. The read may be on a replica, so the write borrows a
+    primary connection; if it fails the body is still served.
     '''
-    method = event.get('httpMethod', 'GET')
+    prepared = content_store.prepare(content)
+    try:
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute(content_store.MIGRATE_PIN_SQL, dict(prepared, pin_id=pin_id))
+    except Exception as exc:
+        instrument.log({'level': 'warning', 'event': 'content_migrate_failed', 'pin_id': pin_id, 'error': repr(exc)})
+    return {'size': prepared['content_size'], 'digest': prepared['content_hash'], 'codec': None}
+
+def raw_response(cur, event, pin_id):
+    '''Serve pin content as text/plain with a strong ETag, byte ranges and compression'''
+    # p.content is only set on pins not yet moved to pin_contents
+    cur.execute("""
+        SELECT c.size, p.content_hash as digest, c.codec, p.content
+        FROM pins p
+        LEFT JOIN pin_contents c ON c.hash = p.content_hash
+        WHERE p.id = %s AND p.reports < 10
+    """, (pin_id,))
+    meta = cur.fetchone()
+    inline = None
+    if meta and meta['digest'] is None:
+        content = meta['content'] or ''
+        inline = content.encode()
+        meta = migrate_inline(pin_id, content)
+    if not meta:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'text/plain; charset=utf-8', 'Access-Control-Allow-Origin': '*'},
+            'body': 'Pin not found',
+            'isBase64Encoded': False
+        }
     
-    if method == 'OPTIONS':
+    size = meta['size']
+    headers = {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag, Content-Range, Accept-Ranges',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding'
+    }
+    
+    byte_range = parse_range(responses.get_header(event, 'range'), size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return {'statusCode': 416, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    
+    encoding = negotiate_encoding(event) if byte_range is None and size >= RAW_COMPRESS_MIN_BYTES else None
+    # Each encoded representation needs its own strong validator
+    headers['ETag'] = f'"{meta["digest"]}-{encoding}"' if encoding else f'"{meta["digest"]}"'
+    if_none_match = responses.get_header(event, 'if-none-match')
+    if if_none_match and headers['ETag'] in [tag.strip() for tag in if_none_match.split(',')]:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    
+    start, end = byte_range or (0, size - 1)
+    if inline is not None:
+        data = inline[start:end + 1]
+    else:
+        cur.execute("SELECT body FROM pin_contents WHERE hash = %s", (meta['digest'],))
+        # Decompression stops at the end of the requested range
+        data = content_store.decompress(meta['codec'], cur.fetchone()['body'], max_bytes=end + 1)[start:end + 1]
+    
+    if byte_range is not None:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return {
+            'statusCode': 206,
+            'headers': headers,
+            'body': base64.b64encode(bytes(data)).decode(),
+            'isBase64Encoded': True
+        }
+    
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        if encoding == 'br':
+            import brotli
+            compressed = brotli.compress(bytes(data))
+        else:
+            compressed = gzip.compress(bytes(data), compresslevel=6)
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
+            'headers': headers,
+            'body': base64.b64encode(compressed).decode(),
+            'isBase64Encoded': True
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    return {'statusCode': 200, 'headers': headers, 'body': data.decode(), 'isBase64Encoded': False}
+
+def feed_cache_key(params):
+    '''Cache key for the default (newest, unfiltered) feed, None for other feeds'''
+    if params.get('id') or params.get('search', '').strip() or params.get('tag') or params.get('sort', 'newest') != 'newest':
+        return None
+    user_id = params.get('user_id') or 0
+    key_parts = [user_id, parse_page_size(params.get('limit'), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE), params.get('cursor') or '']
+    if user_id:
+        # Personalized pages carry is_favorite, so they also follow the user's favorites
+        key_parts.append(cache.version(cache.favorites_namespace(user_id)))
+    return cache.namespace_key('feed', *key_parts)
+
+def finish_detail(pin):
+    '''Fill content from pin_contents for a DETAIL_SQL row'''
+    if pin:
+        codec, blob = pin.pop('content_codec'), pin.pop('content_body')
+        if pin['content'] is None and codec:
+            pin['content'] = content_store.decompress(codec, blob).decode()
+    return pin
+
+def build_feed_query(params):
+    '''Return (sort_by, limit, query, query_params) for a feed request, or None for an invalid cursor'''
+    user_id = params.get('user_id')
+    sort_by = params.get('sort', 'newest')
+    search = params.get('search', '').strip()
+    if 'sort' not in params and search:
+        sort_by = 'relevance'
+    if sort_by not in FEED_SORTS or (sort_by == 'relevance' and not search):
+        sort_by = 'newest'
+    seek_columns, key_type, order_clause, seek_op = FEED_SORTS[sort_by]
+    limit = parse_page_size(params.get('limit'), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
     
-    if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        pin_id = params.get('id')
-        user_id = params.get('user_id')
-        sort_by = params.get('sort', 'newest')
-        search = params.get('search', '')
-        
-        if pin_id:
-            cur.execute("""
-                UPDATE pins SET views = views + 1 WHERE id = %s
-            """, (pin_id,))
-            conn.commit()
-            
-            cur.execute("""
-                SELECT p.*, u.username as author, u.is_verified as author_verified
+    columns = f'{FEED_COLUMNS}, u.username as author, u.is_verified as author_verified'
+    joins = 'JOIN users u ON p.author_id = u.id'
+    conditions = [
+        'p.reports < 10',
+        '(p.is_private = false OR p.author_id = %(user_id)s)'
+    ]
+    query_params = {'user_id': user_id or 0, 'limit': limit + 1}
+    
+    if sort_by == 'trending':
+        columns += ', p.trending_score'
+    
+    if user_id:
+        columns += ', f.id IS NOT NULL as is_favorite'
+        joins += ' LEFT JOIN favorites f ON f.pin_id = p.id AND f.user_id = %(user_id)s'
+    
+    if search:
+        # tsvector match over title/tags/content, trigram fallback for substrings and typos
+        conditions.append(f"(p.search_vector @@ {SEARCH_QUERY} OR p.title ILIKE %(pattern)s OR p.title %% %(search)s)")
+        query_params.update(search=search, pattern=f'%{escape_like(search)}%')
+    
+    tag = params.get('tag', '').strip()
+    if tag:
+        conditions.append('p.tags @> ARRAY[%(tag)s]::text[]')
+        query_params['tag'] = tag
+    
+    seek = ''
+    cursor_token = params.get('cursor')
+    if cursor_token:
+        position = decode_feed_cursor(cursor_token, sort_by)
+        if not position:
+            return None
+        seek = f'{seek_columns} {seek_op} (%(seek_key)s::{key_type}, %(seek_id)s)'
+        query_params.update(seek_key=position[0], seek_id=position[1])
+    
+    if sort_by == 'relevance':
+        query = f"""
+            SELECT * FROM (
+                SELECT {columns},
+                    (ts_rank_cd(p.search_vector, {SEARCH_QUERY}) + similarity(p.title, %(search)s))::float8 as rank
                 FROM pins p
-                JOIN users u ON p.author_id = u.id
-                WHERE p.id = %s AND p.reports < 10
-            """, (pin_id,))
-            pin = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            if not pin:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Pin not found'}),
-                    'isBase64Encoded': False
-                }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'pin': dict(pin)}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        order_clause = {
-            'newest': 'p.created_at DESC',
-            'oldest': 'p.created_at ASC',
-            'views': 'p.views DESC'
-        }.get(sort_by, 'p.created_at DESC')
-        
+                {joins}
+                WHERE {' AND '.join(conditions)}
+            ) ranked
+            {'WHERE ' + seek if seek else ''}
+            ORDER BY {order_clause}
+            LIMIT %(limit)s
+        """
+    else:
+        if seek:
+            conditions.append(seek)
         query = f"""
-            SELECT p.*, u.username as author, u.is_verified as author_verified
+            SELECT {columns}
             FROM pins p
-            JOIN users u ON p.author_id = u.id
-            WHERE p.reports < 10 
-                AND (p.is_private = false OR p.author_id = %s)
-                AND p.title ILIKE %s
+            {joins}
+            WHERE {' AND '.join(conditions)}
             ORDER BY {order_clause}
-            LIMIT 100
+            LIMIT %(limit)s
         """
-        
-        cur.execute(query, (user_id or 0, f'%{search}%'))
-        pins = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'pins': [dict(p) for p in pins]}, default=str),
-            'isBase64Encoded': False
-        }
     
+    return sort_by, limit, query, query_params
+
+@instrument.handler('pins')
+def handler(event, context):
+    '''
+    Business: Handle pins CRUD operations
+    Args: event with httpMethod, body, queryStringParameters
+    Returns: HTTP response with pins data
+    '''
+    method = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return responses.preflight('GET, POST, PUT, DELETE, OPTIONS', 'Content-Type, X-User-Id, Authorization, If-None-Match, Range, X-Read-After')
+    
+    if method == 'DELETE':
+        _, denied = tokens.require_role(event, 'admin')
+        if denied:
+            return denied
     elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        title = body_data.get('title', '').strip()
-        content = body_data.get('content', '').strip()
-        author_id = body_data.get('author_id')
-        is_private = body_data.get('is_private', False)
-        tags = body_data.get('tags', [])
-        
-        if not title or not content or not author_id:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Missing required fields'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.execute("""
-            INSERT INTO pins (title, content, author_id, is_private, tags)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id, title, content, author_id, is_private, tags, views, reports, created_at
-        """, (title, content, author_id, is_private, tags))
-        
-        pin = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'pin': dict(pin)}, default=str),
-            'isBase64Encoded': False
-        }
+        # The author is whoever the session token says, never a body field
+        claims, denied = tokens.require_user(event)
+        if denied:
+            return denied
     
-    elif method == 'DELETE':
-        body_data = json.loads(event.get('body', '{}'))
-        pin_id = body_data.get('pin_id')
-        user_id = body_data.get('user_id')
+    feed_key = None
+    tags_key = None
+    read_only = False
+    read_after = None
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        # A client reading after its own write skips cached lists, which may predate the write
+        read_after = db.read_after(event)
+        if params.get('action') == 'tags':
+            # Tag counts change with pin create/hide, which bump the feed namespace
+            tags_key = cache.namespace_key('feed', 'tags', parse_page_size(params.get('limit'), DEFAULT_TAG_LIMIT, MAX_TAG_LIMIT))
+            entry = cache.get(tags_key) if read_after is None else None
+            if entry:
+                return cache.respond(event, entry)
+        else:
+            # The default feed is answered from cache without borrowing a connection
+            feed_key = feed_cache_key(params)
+            entry = cache.get(feed_key) if feed_key and read_after is None else None
+            if entry:
+                return cache.respond(event, entry)
+        # Everything but pin detail, which logs the view, can be read from a replica
+        read_only = not params.get('id') or bool(params.get('raw'))
+    
+    with db.connection(read_only=read_only, min_lsn=read_after) as conn:
+        cur = db.dict_cursor(conn)
         
-        if not pin_id or not user_id:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Missing pin_id or user_id'}),
-                'isBase64Encoded': False
-            }
+        if method == 'GET':
+            params = event.get('queryStringParameters') or {}
+            pin_id = params.get('id')
+            
+            if pin_id and params.get('raw'):
+                return raw_response(cur, event, pin_id)
+            
+            if params.get('action') == 'tags':
+                cur.execute("""
+                    SELECT tag, pin_count FROM tag_counts
+                    WHERE pin_count > 0
+                    ORDER BY pin_count DESC, tag
+                    LIMIT %s
+                """, (parse_page_size(params.get('limit'), DEFAULT_TAG_LIMIT, MAX_TAG_LIMIT),))
+                body = responses.dumps({'tags': cur.fetchall()})
+                return cache.respond(event, cache.put(tags_key, body, cache.FEED_TTL))
+            
+            if not read_only or not db.REPLICA_URLS:
+                views.maybe_flush(conn)
+            elif views.due():
+                # This connection may be a replica; the flush writes
+                with db.connection() as primary:
+                    views.flush(primary, views.INLINE_BATCH)
+            
+            if pin_id:
+                entry = cache.get(cache.pin_key(pin_id))
+                if entry:
+                    cur.execute("INSERT INTO pin_view_events (pin_id) VALUES (%s)", (pin_id,))
+                    return cache.respond(event, entry)
+                
+                cur.execute(DETAIL_SQL, {'pin_id': pin_id})
+                pin = finish_detail(cur.fetchone())
+                
+                if not pin:
+                    return responses.error(404, 'Pin not found')
+                
+                body = responses.dumps({'pin': pin})
+                return cache.respond(event, cache.put(cache.pin_key(pin_id), body, cache.PIN_TTL))
+            
+            feed = build_feed_query(params)
+            if not feed:
+                return responses.error(400, 'Invalid cursor')
+            sort_by, limit, query, query_params = feed
+            
+            cur.execute(query, query_params)
+            pins = cur.fetchall()
+            
+            next_cursor = None
+            if len(pins) > limit:
+                pins = pins[:limit]
+                next_cursor = encode_feed_cursor(sort_by, pins[-1])
+            
+            body = responses.dumps({'pins': pins, 'next_cursor': next_cursor})
+            if feed_key:
+                return cache.respond(event, cache.put(feed_key, body, cache.FEED_TTL))
+            
+            return responses.send(200, body, event)
         
-        cur.execute("SELECT username FROM users WHERE id = %s", (user_id,))
-        user = cur.fetchone()
+        elif method == 'POST':
+            body_data = json.loads(event.get('body', '{}'))
+            title = body_data.get('title', '').strip()
+            content = body_data.get('content', '').strip()
+            author_id = claims['sub']
+            is_private = body_data.get('is_private', False)
+            tags = body_data.get('tags', [])
+            
+            if not title or not content:
+                return responses.error(400, 'Missing required fields')
+            
+            # The body goes to pin_contents (deduplicated, compressed); pins keeps the hash and
+            # the content lexemes for search. Public pins are announced on the change feed.
+            cur.execute(f"""
+                WITH {content_store.STORE_CTE}, inserted AS (
+                    INSERT INTO pins (title, content_hash, preview, content_length, author_id, is_private, tags, search_vector)
+                    VALUES (%(title)s, %(content_hash)s, %(preview)s, %(content_length)s, %(author_id)s, %(is_private)s, %(tags)s,
+                        setweight(to_tsvector('simple', left(%(content)s, 100000)), 'C'))
+                    RETURNING id, title, author_id, is_private, tags, views, reports, created_at
+                ), {changes.NOTIFY_PIN_CTE}
+                SELECT i.* FROM inserted i LEFT JOIN notified ON true
+            """, dict(
+                content_store.prepare(content),
+                title=title,
+                content=content,
+                preview=content[:content_store.PREVIEW_LENGTH],
+                content_length=len(content),
+                author_id=author_id,
+                is_private=is_private,
+                tags=tags
+            ))
+            
+            pin = cur.fetchone()
+            pin['content'] = content
+            cache.bump('feed')
+            
+            return responses.json_response(201, {'pin': pin}, event, db.write_token(conn))
         
-        if user and user['username'] == 'Developer':
+        elif method == 'DELETE':
+            body_data = json.loads(event.get('body', '{}'))
+            pin_id = body_data.get('pin_id')
+            
+            if not pin_id:
+                return responses.error(400, 'Missing pin_id')
+            
             cur.execute("UPDATE pins SET reports = 999 WHERE id = %s", (pin_id,))
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
+            cache.invalidate(cache.pin_key(pin_id))
+            cache.bump('feed')
+            
+            return responses.json_response(200, {'success': True}, event, db.write_token(conn))
         
-        cur.close()
-        conn.close()
-        return {
-            'statusCode': 403,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Not authorized'}),
-            'isBase64Encoded': False
-        }
-    
-    cur.close()
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+        return responses.error(405, 'Method not allowed')
@@ -0,0 +1,127 @@
+'''
+Change feed: new comments and new public pins, announced with NOTIFY.
+
+Writers add NOTIFY_COMMENT_CTE / NOTIFY_PIN_CTE to the statement that inserts
+the row (over an `inserted` CTE), so the notification goes out on commit with
+no extra round trip. Payloads are only `comment:<pin_id>:<id>` or `pin:<id>`;
+listeners load the rows themselves, once per process rather than once per
+subscriber.
+
+Subscribers follow a topic (`comments:<pin_id>` or `pins`) and catch up with
+`since`, the last id they have seen. SERIAL ids are handed out at insert but
+become visible at commit, so a lower id can appear after a higher one has been
+delivered; catching up therefore walks (created_at, id) and starts
+CATCH_UP_OVERLAP_SECONDS before the `since` row. The overlap re-sends rows the
+subscriber may already have, so consumers dedupe by id.
+'''
+CHANNEL = 'newbin_changes'
+CATCH_UP_LIMIT = 500
+# Longer than any inserting transaction runs, so every row committed after `since` falls inside
+CATCH_UP_OVERLAP_SECONDS = 5
+
+# The CTEs call a volatile function, so they run as long as the outer query joins them
+NOTIFY_COMMENT_CTE = f"""
+    notified AS (
+        SELECT pg_notify('{CHANNEL}', 'comment:' || pin_id || ':' || id) FROM inserted
+    )
+"""
+NOTIFY_PIN_CTE = f"""
+    notified AS (
+        SELECT pg_notify('{CHANNEL}', 'pin:' || id) FROM inserted WHERE NOT is_private
+    )
+"""
+
+COMMENTS_SQL = """
+    SELECT c.*, u.username as author, u.is_verified as author_verified
+    FROM comments c
+    JOIN users u ON u.id = c.author_id
+    WHERE {condition} AND c.reports < 5
+    ORDER BY {order}
+    LIMIT %(limit)s
+"""
+
+PINS_SQL = """
+    SELECT p.id, p.title, p.preview, p.content_length, p.author_id, p.tags, p.created_at,
+        u.username as author, u.is_verified as author_verified
+    FROM pins p
+    JOIN users u ON u.id = p.author_id
+    WHERE {condition} AND p.reports < 10 AND NOT p.is_private
+    ORDER BY {order}
+    LIMIT %(limit)s
+"""
+
+def parse(payload):
+    '''(topic, id) for a notification payload, or None'''
+    kind, _, rest = payload.partition(':')
+    try:
+        if kind == 'comment':
+            pin_id, _, comment_id = rest.partition(':')
+            return f'comments:{int(pin_id)}', int(comment_id)
+        if kind == 'pin':
+            return 'pins', int(rest)
+    except ValueError:
+        pass
+    return None
+
+def topic_for(params):
+    '''Topic named by the request parameters: comments of ?pin_id=, else new pins'''
+    pin_id = params.get('pin_id')
+    if pin_id is None:
+        return 'pins'
+    try:
+        return f'comments:{int(pin_id)}'
+    except ValueError:
+        return None
+
+def make_event(topic, row):
+    if topic == 'pins':
+        return {'type': 'pin', 'id': row['id'], 'pin': row}
+    return {'type': 'comment', 'id': row['id'], 'pin_id': row['pin_id'], 'comment': row}
+
+# Where catching up starts: the overlap before the newest row at or below `since`
+START_SQL = """
+    {alias}.created_at >= coalesce(
+        (SELECT created_at FROM {table} WHERE id <= %(since)s ORDER BY id DESC LIMIT 1), '-infinity'
+    ) - make_interval(secs => %(overlap)s)
+"""
+
+def position(event):
+    '''(created_at, id) of an event, the key catch-up pages are walked by'''
+    return event[event['type']]['created_at'], event['id']
+
+def since(cur, topic, since_id, after=None, limit=CATCH_UP_LIMIT):
+    '''
+    Events on topic from the overlap before since_id, in (created_at, id)
+    order; `after` (a position()) continues from the previous page instead.
+    '''
+    alias, table = ('p', 'pins') if topic == 'pins' else ('c', 'comments')
+    if after is None:
+        condition = START_SQL.format(alias=alias, table=table)
+    else:
+        condition = f'({alias}.created_at, {alias}.id) > (%(after_at)s, %(after_id)s)'
+    params = {
+        'since': since_id, 'overlap': CATCH_UP_OVERLAP_SECONDS, 'limit': limit,
+        'after_at': after and after[0], 'after_id': after and after[1]
+    }
+    order = f'{alias}.created_at, {alias}.id'
+    if topic == 'pins':
+        cur.execute(PINS_SQL.format(condition=condition, order=order), params)
+    else:
+        params['pin_id'] = int(topic.split(':', 1)[1])
+        cur.execute(COMMENTS_SQL.format(condition='c.pin_id = %(pin_id)s AND ' + condition, order=order), params)
+    return [make_event(topic, row) for row in cur.fetchall()]
+
+def by_id(cur, wanted):
+    '''Events for {topic: [ids]} with at most one query per kind'''
+    events = []
+    comment_ids = [i for topic, ids in wanted.items() if topic != 'pins' for i in ids]
+    if comment_ids:
+        cur.execute(COMMENTS_SQL.format(condition='c.id = ANY(%(ids)s)', order='c.id'), {'ids': comment_ids, 'limit': len(comment_ids)})
+        events += [make_event(f"comments:{row['pin_id']}", row) for row in cur.fetchall()]
+    if wanted.get('pins'):
+        cur.execute(PINS_SQL.format(condition='p.id = ANY(%(ids)s)', order='p.id'), {'ids': wanted['pins'], 'limit': len(wanted['pins'])})
+        events += [make_event('pins', row) for row in cur.fetchall()]
+    return events
+
+def event_topic(event):
+    return 'pins' if event['type'] == 'pin' else f"comments:{event['pin_id']}"
@@ -0,0 +1,91 @@
+'''
+Async PostgreSQL access for the gateway's async handlers.
+
+Built on psycopg 3 and psycopg_pool (gateway/requirements.txt), imported on
+first use so the sync functions never load them. Connections are autocommit
+and return rows as dicts, like db.dict_cursor.
+
+`pipelined()` sends several independent statements in one pipeline, so they
+cost one network round trip instead of one each. Statements that depend on an
+earlier result belong in one statement (a CTE) rather than a pipeline.
+'''
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+from shared import db, instrument
+
+POOL_MIN = db.POOL_MIN
+POOL_MAX = int(os.environ.get('ADB_POOL_MAX', str(db.POOL_MAX)))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                from psycopg.rows import dict_row
+                from psycopg_pool import AsyncConnectionPool
+                pool = AsyncConnectionPool(
+                    os.environ['DATABASE_URL'], min_size=POOL_MIN, max_size=POOL_MAX, timeout=db.POOL_TIMEOUT,
+                    kwargs={'autocommit': True, 'row_factory': dict_row}, open=False
+                )
+                await pool.open()
+                _pool = pool
+    return _pool
+
+@asynccontextmanager
+async def connection():
+    '''Borrow a pooled async connection; raises db.PoolTimeout like db.connection()'''
+    from psycopg_pool import PoolTimeout
+    pool = await get_pool()
+    started = time.perf_counter()
+    try:
+        conn = await pool.getconn()
+    except PoolTimeout as exc:
+        raise db.PoolTimeout(str(exc)) from exc
+    if instrument.ENABLED:
+        instrument.add_timing('connect', started)
+    try:
+        yield conn
+    finally:
+        await pool.putconn(conn)
+
+async def fetch(conn, query, params=None):
+    '''Run one statement; returns its rows, or None when it returns none'''
+    return (await pipelined(conn, [(query, params)]))[0]
+
+async def pipelined(conn, statements):
+    '''
+    Send [(query, params), ...] in one pipeline and return each statement's rows
+    (None for statements without a result set), in order
+    '''
+    started = time.perf_counter()
+    cursors = []
+    if len(statements) == 1:
+        cur = conn.cursor()
+        await cur.execute(*statements[0])
+        cursors.append(cur)
+    else:
+        async with conn.pipeline():
+            for query, params in statements:
+                cur = conn.cursor()
+                await cur.execute(query, params)
+                cursors.append(cur)
+    results = []
+    rows = 0
+    for cur in cursors:
+        results.append(await cur.fetchall() if cur.description else None)
+        rows += max(cur.rowcount, 0)
+    if instrument.ENABLED:
+        instrument.add_queries(len(statements), rows, started)
+    return results
+
+async def close():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -0,0 +1,76 @@
+'''
+Content-addressed, compressed pin bodies (table pin_contents).
+
+Bodies are keyed by the SHA-256 of their UTF-8 encoding, so identical pastes
+are stored once. They are compressed at write time with zstd when the
+`zstandard` package is available and zlib otherwise; the codec is stored per
+row so both can be read back.
+'''
+import hashlib
+import importlib.util
+import zlib
+
+# zstandard is only imported when a body is (de)compressed with it
+CODEC = 'zstd' if importlib.util.find_spec('zstandard') is not None else 'zlib'
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+# pins.preview holds this many leading characters of the body
+PREVIEW_LENGTH = 280
+
+# Writes the body (if new) and must run in the same statement as the pins write
+# that references it, e.g. as a CTE
+STORE_CTE = """
+    stored AS (
+        INSERT INTO pin_contents (hash, codec, body, size)
+        VALUES (%(content_hash)s, %(content_codec)s, %(content_body)s, %(content_size)s)
+        ON CONFLICT (hash) DO NOTHING
+    )
+"""
+
+# Moves one pin's inline content into pin_contents; content IS NOT NULL guards
+# against a concurrent migration having done it already
+MIGRATE_PIN_SQL = f"""
+    WITH {STORE_CTE.strip()}
+    UPDATE pins SET content_hash = %(content_hash)s, content = NULL
+    WHERE id = %(pin_id)s AND content IS NOT NULL
+"""
+
+def compress(data):
+    if CODEC == 'zstd':
+        import zstandard
+        return 'zstd', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return 'zlib', zlib.compress(data, ZLIB_LEVEL)
+
+def decompress(codec, blob, max_bytes=None):
+    '''Decode a stored body; with max_bytes, stop once that many bytes are available'''
+    blob = bytes(blob)
+    if codec == 'zlib':
+        if max_bytes is None:
+            return zlib.decompress(blob)
+        return zlib.decompressobj().decompress(blob, max_bytes)
+    if codec == 'zstd':
+        import zstandard
+        if max_bytes is None:
+            return zstandard.ZstdDecompressor().decompress(blob)
+        reader = zstandard.ZstdDecompressor().stream_reader(blob)
+        data = bytearray()
+        while len(data) < max_bytes:
+            chunk = reader.read(max_bytes - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
+    if codec == 'none':
+        return blob if max_bytes is None else blob[:max_bytes]
+    raise ValueError(f'Unknown content codec: {codec}')
+
+def prepare(text):
+    '''Return the STORE_CTE parameters for a body'''
+    data = text.encode()
+    codec, blob = compress(data)
+    return {
+        'content_hash': hashlib.sha256(data).hexdigest(),
+        'content_codec': codec,
+        'content_body': blob,
+        'content_size': len(data)
+    }
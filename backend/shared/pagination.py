@@ -0,0 +1,54 @@
+'''Opaque keyset cursors and page-size parsing shared by the list endpoints'''
+import base64
+import json
+import math
+from datetime import datetime
+
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    '''Return the list of values packed by encode_cursor, or None if the token is malformed'''
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def is_timestamp(value):
+    '''ISO-8601 text, as written by isoformat(), that a ::timestamp cast accepts'''
+    if not isinstance(value, str):
+        return False
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+def decode_position(token, *checks):
+    '''
+    The values packed by encode_cursor when there is one per check and each
+    passes, else None. Keys are checked before they reach a query, so a forged
+    cursor gets a 400 rather than a database error.
+    '''
+    values = decode_cursor(token)
+    if not values or len(values) != len(checks):
+        return None
+    if not all(check(value) for check, value in zip(checks, values)):
+        return None
+    return values
+
+def parse_page_size(value, default, maximum):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
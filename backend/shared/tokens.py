@@ -0,0 +1,123 @@
+'''
+Signed session tokens.
+
+auth issues `<payload>.<signature>` (both base64url) on login and register;
+the payload carries the user id, role and expiry, and the signature is an
+HMAC-SHA256 under SESSION_SECRET, so every handler verifies a token in
+memory. Clients send it as `Authorization: Bearer <token>`.
+
+Banning a user revokes the tokens issued to them so far. Revocations live in
+the cache's shared tier for the token lifetime and are read through its
+in-process tier, so a ban reaches other containers within CACHE_LOCAL_TTL
+seconds. Without a shared tier (no CACHE_URL) the ban itself is the record:
+tokens of a user whose row is banned are rejected, looked up at most once
+per CACHE_LOCAL_TTL per container.
+'''
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from shared import cache, db, responses
+
+SECRET = os.environ.get('SESSION_SECRET', '').encode()
+TOKEN_TTL = int(os.environ.get('SESSION_TTL', str(7 * 24 * 3600)))
+
+ADMIN_USERNAME = 'Developer'
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def configured():
+    return bool(SECRET)
+
+def _sign(payload):
+    if not SECRET:
+        raise RuntimeError('SESSION_SECRET is not set')
+    return hmac.new(SECRET, payload.encode(), hashlib.sha256).digest()
+
+def role_for(user):
+    return 'admin' if user['username'] == ADMIN_USERNAME else 'user'
+
+def issue(user):
+    '''Return a token for a users row (id, username)'''
+    now = int(time.time())
+    claims = {'sub': user['id'], 'role': role_for(user), 'iat': now, 'exp': now + TOKEN_TTL}
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'{payload}.{_b64encode(_sign(payload))}'
+
+def verify(token):
+    '''Return the claims of a valid, unexpired, unrevoked token, else None'''
+    if not token or not SECRET:
+        return None
+    payload, _, signature = token.partition('.')
+    try:
+        valid = hmac.compare_digest(_b64decode(signature), _sign(payload))
+        claims = json.loads(_b64decode(payload)) if valid else None
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get('sub'), int):
+        return None
+    if claims.get('exp', 0) <= time.time() or is_revoked(claims):
+        return None
+    return claims
+
+def from_event(event):
+    '''Claims from the request's bearer token, or None'''
+    scheme, _, token = (responses.get_header(event, 'authorization') or '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return verify(token.strip())
+
+def require_user(event):
+    '''Return (claims, None) for a signed-in caller, else (None, 401 response)'''
+    claims = from_event(event)
+    if not claims:
+        return None, responses.error(401, 'Not authenticated')
+    return claims, None
+
+def require_role(event, role):
+    '''Return (claims, None) for a caller with role, else (None, 403 response)'''
+    claims = from_event(event)
+    if not claims or claims.get('role') != role:
+        return None, responses.error(403, 'Not authorized')
+    return claims, None
+
+def revocation_key(user_id):
+    return f'revoked:{user_id}'
+
+def _banned_since(user_id):
+    '''Revocation time from the users table: always for banned or missing users, never otherwise'''
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT is_banned FROM users WHERE id = %s", (user_id,))
+            row = cur.fetchone()
+    return 'inf' if row is None or row[0] else '0'
+
+def is_revoked(claims):
+    key = revocation_key(claims['sub'])
+    revoked_at = cache.local.get(key)
+    if revoked_at is None:
+        if cache.shared is not None:
+            revoked_at = cache.shared.get(key) or '0'
+        else:
+            revoked_at = _banned_since(claims['sub'])
+        # Negative answers are cached too, so the common case never leaves the process
+        cache.local.set(key, revoked_at, cache.LOCAL_TTL)
+    return claims.get('iat', 0) <= float(revoked_at)
+
+def revoke(user_id):
+    '''Invalidate every token issued to user_id until now'''
+    key = revocation_key(user_id)
+    revoked_at = str(time.time())
+    cache.local.set(key, revoked_at, cache.LOCAL_TTL)
+    if cache.shared is not None:
+        cache.shared.set(key, revoked_at, TOKEN_TTL)
+
+def restore(user_id):
+    cache.invalidate(revocation_key(user_id))
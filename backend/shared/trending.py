@@ -0,0 +1,32 @@
+'''
+Incremental refresh of pins.trending_score.
+
+Triggers mark a pin trending_dirty when its views, favorite_count or
+comment_count change; refresh() rescores a batch of marked pins with
+pin_trending_score() (db_migrations/V0010). The score does not depend on the
+current time, so untouched pins never need rescoring.
+'''
+import os
+
+REFRESH_INTERVAL = float(os.environ.get('TRENDING_REFRESH_INTERVAL', '60'))
+REFRESH_BATCH = int(os.environ.get('TRENDING_REFRESH_BATCH', '10000'))
+
+REFRESH_SQL = """
+    WITH batch AS (
+        SELECT id FROM pins WHERE trending_dirty
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE pins p
+    SET trending_score = pin_trending_score(p.views, p.favorite_count, p.comment_count, p.created_at),
+        trending_dirty = false
+    FROM batch
+    WHERE p.id = batch.id
+"""
+
+def refresh(conn):
+    '''Rescore one batch of dirty pins; returns the number of pins updated'''
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(REFRESH_SQL, (REFRESH_BATCH,))
+            return cur.rowcount
@@ -0,0 +1,68 @@
+'''
+Buffered view counting.
+
+Opening a pin appends a row to pin_view_events; flush() drains the log and
+applies the totals to pins.views in one bulk UPDATE. jobs/flush_views.py
+drains the log in FLUSH_BATCH chunks. A pins invocation may also flush once
+FLUSH_INTERVAL has passed, but only INLINE_BATCH events, so a backlog never
+lands on a user's request; VIEW_FLUSH_INLINE_BATCH=0 leaves flushing to the job.
+'''
+import os
+import time
+
+FLUSH_INTERVAL = float(os.environ.get('VIEW_FLUSH_INTERVAL', '10'))
+FLUSH_BATCH = int(os.environ.get('VIEW_FLUSH_BATCH', '50000'))
+INLINE_BATCH = int(os.environ.get('VIEW_FLUSH_INLINE_BATCH', '500'))
+# pg advisory lock key so only one container flushes at a time
+FLUSH_LOCK_KEY = 7300401
+
+# One statement, so the transaction-scoped advisory lock holds for the whole
+# drain even on an autocommit connection; without the lock nothing is drained
+FLUSH_SQL = """
+    WITH locked AS (
+        SELECT pg_try_advisory_xact_lock(%s) AS ok
+    ), drained AS (
+        DELETE FROM pin_view_events
+        WHERE id IN (
+            SELECT id FROM pin_view_events
+            WHERE (SELECT ok FROM locked)
+            ORDER BY id LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING pin_id
+    ), totals AS (
+        SELECT pin_id, count(*) AS n FROM drained GROUP BY pin_id
+    ), applied AS (
+        UPDATE pins p SET views = p.views + totals.n
+        FROM totals
+        WHERE p.id = totals.pin_id
+    )
+    SELECT count(*) FROM drained
+"""
+INLINE_FLUSH_PARAMS = (FLUSH_LOCK_KEY, INLINE_BATCH)
+
+_last_flush = 0.0
+
+def flush(conn, batch=FLUSH_BATCH):
+    '''
+    Coalesce up to batch pending view events into pins.views; returns the number
+    of events drained (events for deleted pins are drained too, without an update)
+    '''
+    with conn.cursor() as cur:
+        cur.execute(FLUSH_SQL, (FLUSH_LOCK_KEY, batch))
+        return cur.fetchone()[0]
+
+def due():
+    '''True at most once per FLUSH_INTERVAL in this container, never with inline flushing off'''
+    global _last_flush
+    if INLINE_BATCH <= 0:
+        return False
+    now = time.monotonic()
+    if now - _last_flush < FLUSH_INTERVAL:
+        return False
+    _last_flush = now
+    return True
+
+def maybe_flush(conn):
+    '''Small inline flush for request paths'''
+    return flush(conn, INLINE_BATCH) if due() else 0
@@ -0,0 +1,87 @@
+'''
+Copy the backend/shared/ modules each function uses into its directory.
+
+Each function is deployed from its own directory only, so `from shared import`
+needs a copy of the package next to index.py. Only the modules the function
+imports (directly or through other shared modules) are copied. Locally the
+functions put backend/ first on sys.path and import the original; deployed,
+the copy is the only one there. Run this after changing anything in shared/
+or a function's shared imports, and commit the copies with it:
+
+    python backend/sync_shared.py            # refresh the copies
+    python backend/sync_shared.py --check    # exit 1 if any copy is stale
+'''
+import ast
+import filecmp
+import os
+import shutil
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(BACKEND_DIR, 'shared')
+FUNCTIONS = ('pins', 'auth', 'actions', 'comments', 'admin')
+
+def shared_imports(path):
+    '''Names of the shared modules imported anywhere in the file at path'''
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module == 'shared':
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and (node.module or '').startswith('shared.'):
+            names.add(node.module.split('.')[1])
+        elif isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[1] for alias in node.names if alias.name.startswith('shared.'))
+    return names
+
+def needed_files(function):
+    '''File names in shared/ that the function's index.py needs, with __init__.py'''
+    pending = shared_imports(os.path.join(BACKEND_DIR, function, 'index.py'))
+    modules = set()
+    while pending:
+        name = pending.pop()
+        if name in modules:
+            continue
+        modules.add(name)
+        pending |= shared_imports(os.path.join(SOURCE_DIR, f'{name}.py'))
+    return ['__init__.py'] + sorted(f'{name}.py' for name in modules)
+
+def stale(function, target_dir):
+    '''Names in target_dir that are missing, differ from shared/, or are no longer needed'''
+    names = needed_files(function)
+    present = sorted(name for name in os.listdir(target_dir) if name.endswith('.py')) if os.path.isdir(target_dir) else []
+    differing = [
+        name for name in names
+        if name not in present or not filecmp.cmp(os.path.join(SOURCE_DIR, name), os.path.join(target_dir, name), shallow=False)
+    ]
+    return differing + [name for name in present if name not in names]
+
+def sync(function, target_dir):
+    os.makedirs(target_dir, exist_ok=True)
+    names = needed_files(function)
+    for name in os.listdir(target_dir):
+        if name.endswith('.py') and name not in names:
+            os.remove(os.path.join(target_dir, name))
+    for name in names:
+        shutil.copyfile(os.path.join(SOURCE_DIR, name), os.path.join(target_dir, name))
+
+def main():
+    check = '--check' in sys.argv[1:]
+    outdated = False
+    for function in FUNCTIONS:
+        target_dir = os.path.join(BACKEND_DIR, function, 'shared')
+        names = stale(function, target_dir)
+        if not names:
+            continue
+        if check:
+            outdated = True
+            print(f'{function}/shared is stale: {", ".join(names)}', file=sys.stderr)
+        else:
+            sync(function, target_dir)
+            print(f'{function}/shared: updated {", ".join(names)}')
+    if outdated:
+        sys.exit('run python backend/sync_shared.py')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+-- Composite indexes backing keyset pagination of the pins feed.
+-- The partial predicate matches the feed filter so hidden pins are never scanned;
+-- the 'oldest' sort walks idx_pins_feed_created backwards.
+CREATE INDEX IF NOT EXISTS idx_pins_feed_created ON pins(created_at DESC, id DESC) WHERE reports < 10;
+CREATE INDEX IF NOT EXISTS idx_pins_feed_views ON pins(views DESC, id DESC) WHERE reports < 10;
@@ -0,0 +1,27 @@
+-- Full-text and trigram search over pins and users
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE pins ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+-- 'simple' config: pastes are code and mixed-language text, so no stemming or stop words
+CREATE OR REPLACE FUNCTION pins_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(array_to_string(NEW.tags, ' '), '')), 'B') ||
+        setweight(to_tsvector('simple', left(coalesce(NEW.content, ''), 100000)), 'C');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_pins_search_vector ON pins;
+CREATE TRIGGER trg_pins_search_vector
+    BEFORE INSERT OR UPDATE OF title, content, tags ON pins
+    FOR EACH ROW EXECUTE FUNCTION pins_search_vector_update();
+
+-- Backfill existing rows through the trigger
+UPDATE pins SET title = title WHERE search_vector IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_pins_search ON pins USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_pins_title_trgm ON pins USING GIN (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING GIN (username gin_trgm_ops);
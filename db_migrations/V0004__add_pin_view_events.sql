@@ -0,0 +1,9 @@
+-- Append-only view log; periodically coalesced into pins.views so opening a pin
+-- never takes a row lock on the pin itself
+CREATE TABLE IF NOT EXISTS pin_view_events (
+    id BIGSERIAL PRIMARY KEY,
+    pin_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_pin_view_events_pin ON pin_view_events(pin_id);
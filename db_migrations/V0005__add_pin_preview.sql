@@ -0,0 +1,7 @@
+-- Precomputed list projection so feed queries never read the full content TOAST
+ALTER TABLE pins ADD COLUMN IF NOT EXISTS preview VARCHAR(280);
+ALTER TABLE pins ADD COLUMN IF NOT EXISTS content_length INTEGER;
+
+UPDATE pins
+SET preview = left(content, 280), content_length = char_length(content)
+WHERE preview IS NULL;
@@ -0,0 +1,43 @@
+-- Denormalized count of visible comments per pin, maintained by trigger
+ALTER TABLE pins ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION comments_maintain_count() RETURNS trigger AS $$
+DECLARE
+    delta INTEGER := 0;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF coalesce(NEW.reports, 0) < 5 THEN
+            delta := 1;
+        END IF;
+    ELSIF TG_OP = 'UPDATE' THEN
+        IF coalesce(OLD.reports, 0) < 5 AND coalesce(NEW.reports, 0) >= 5 THEN
+            delta := -1;
+        ELSIF coalesce(OLD.reports, 0) >= 5 AND coalesce(NEW.reports, 0) < 5 THEN
+            delta := 1;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF coalesce(OLD.reports, 0) < 5 THEN
+            delta := -1;
+        END IF;
+    END IF;
+
+    IF delta <> 0 THEN
+        UPDATE pins SET comment_count = comment_count + delta
+        WHERE id = coalesce(NEW.pin_id, OLD.pin_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_comments_count ON comments;
+CREATE TRIGGER trg_comments_count
+    AFTER INSERT OR UPDATE OF reports OR DELETE ON comments
+    FOR EACH ROW EXECUTE FUNCTION comments_maintain_count();
+
+UPDATE pins p SET comment_count = c.n
+FROM (SELECT pin_id, count(*) AS n FROM comments WHERE reports < 5 GROUP BY pin_id) c
+WHERE p.id = c.pin_id;
+
+-- Keyset pagination of a pin's thread on (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_comments_pin_created ON comments(pin_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_comments_pin;
@@ -0,0 +1,5 @@
+-- Reported-away rows (pins.reports >= 10, comments.reports >= 5) are hidden.
+-- Partial indexes keep them out of the feed and thread scans entirely.
+CREATE INDEX IF NOT EXISTS idx_comments_pin_visible
+    ON comments(pin_id, created_at DESC, id DESC) WHERE reports < 5;
+DROP INDEX IF EXISTS idx_comments_pin_created;
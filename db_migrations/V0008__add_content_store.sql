@@ -0,0 +1,32 @@
+-- Content-addressed, compressed storage for pin bodies.
+-- Identical pastes share one row; pins keeps only the hash.
+CREATE TABLE IF NOT EXISTS pin_contents (
+    hash CHAR(64) PRIMARY KEY,
+    codec VARCHAR(10) NOT NULL,
+    body BYTEA NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Bodies are compressed by the application; skip pglz but keep out-of-line storage
+ALTER TABLE pin_contents ALTER COLUMN body SET STORAGE EXTERNAL;
+
+ALTER TABLE pins ADD COLUMN IF NOT EXISTS content_hash CHAR(64) REFERENCES pin_contents(hash);
+ALTER TABLE pins ALTER COLUMN content DROP NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_pins_content_hash ON pins(content_hash);
+
+-- Rows whose content moved to pin_contents have content = NULL; the writer supplies the
+-- content lexemes (weight C) in search_vector and the trigger keeps them.
+CREATE OR REPLACE FUNCTION pins_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(array_to_string(NEW.tags, ' '), '')), 'B') ||
+        CASE
+            WHEN NEW.content IS NOT NULL
+                THEN setweight(to_tsvector('simple', left(NEW.content, 100000)), 'C')
+            ELSE ts_filter(coalesce(NEW.search_vector, ''::tsvector), '{c}')
+        END;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
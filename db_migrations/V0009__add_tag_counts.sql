@@ -0,0 +1,55 @@
+-- Tag filter on the feed: containment (tags @> ARRAY[...]) over visible pins
+CREATE INDEX IF NOT EXISTS idx_pins_tags ON pins USING GIN (tags) WHERE reports < 10;
+
+-- Tag cloud: number of public, visible pins per tag, maintained incrementally
+CREATE TABLE IF NOT EXISTS tag_counts (
+    tag TEXT PRIMARY KEY,
+    pin_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_tag_counts_popular ON tag_counts(pin_count DESC, tag) WHERE pin_count > 0;
+
+CREATE OR REPLACE FUNCTION pins_maintain_tag_counts() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_private = false AND OLD.reports < 10 THEN
+        UPDATE tag_counts SET pin_count = pin_count - 1
+        WHERE tag IN (SELECT DISTINCT unnest(OLD.tags));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_private = false AND NEW.reports < 10 THEN
+        INSERT INTO tag_counts (tag, pin_count)
+        SELECT DISTINCT unnest(NEW.tags), 1
+        ON CONFLICT (tag) DO UPDATE SET pin_count = tag_counts.pin_count + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Report increments only fire the trigger when they cross the hiding threshold
+DROP TRIGGER IF EXISTS trg_pins_tag_counts_insert ON pins;
+CREATE TRIGGER trg_pins_tag_counts_insert
+    AFTER INSERT ON pins
+    FOR EACH ROW WHEN (NEW.is_private = false AND NEW.reports < 10)
+    EXECUTE FUNCTION pins_maintain_tag_counts();
+
+DROP TRIGGER IF EXISTS trg_pins_tag_counts_update ON pins;
+CREATE TRIGGER trg_pins_tag_counts_update
+    AFTER UPDATE OF tags, is_private, reports ON pins
+    FOR EACH ROW WHEN (
+        OLD.tags IS DISTINCT FROM NEW.tags
+        OR (OLD.is_private = false AND OLD.reports < 10) IS DISTINCT FROM (NEW.is_private = false AND NEW.reports < 10)
+    )
+    EXECUTE FUNCTION pins_maintain_tag_counts();
+
+DROP TRIGGER IF EXISTS trg_pins_tag_counts_delete ON pins;
+CREATE TRIGGER trg_pins_tag_counts_delete
+    AFTER DELETE ON pins
+    FOR EACH ROW WHEN (OLD.is_private = false AND OLD.reports < 10)
+    EXECUTE FUNCTION pins_maintain_tag_counts();
+
+-- Backfill
+INSERT INTO tag_counts (tag, pin_count)
+SELECT tag, count(DISTINCT p.id)
+FROM pins p, unnest(p.tags) AS tag
+WHERE p.is_private = false AND p.reports < 10
+GROUP BY tag
+ON CONFLICT (tag) DO UPDATE SET pin_count = EXCLUDED.pin_count;
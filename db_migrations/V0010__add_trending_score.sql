@@ -0,0 +1,70 @@
+-- "trending" feed sort: a stored, indexed score refreshed by jobs/refresh_trending.py.
+--
+-- score = ln(1 + views + 3 * favorites + 2 * comments) + epoch(created_at) / 45000
+--
+-- This is the log of engagement * exp(age / 45000s), which orders pins exactly like
+-- engagement * exp(-age / 45000s) (half-life ~8.7h) but never changes with the clock,
+-- so only pins whose inputs changed need recomputing.
+ALTER TABLE pins ADD COLUMN IF NOT EXISTS favorite_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE pins ADD COLUMN IF NOT EXISTS trending_score DOUBLE PRECISION NOT NULL DEFAULT 0;
+ALTER TABLE pins ADD COLUMN IF NOT EXISTS trending_dirty BOOLEAN NOT NULL DEFAULT false;
+
+CREATE OR REPLACE FUNCTION pin_trending_score(views INTEGER, favorites INTEGER, comments INTEGER, created_at TIMESTAMP)
+RETURNS DOUBLE PRECISION AS $$
+    SELECT ln(1 + greatest(coalesce(views, 0) + 3 * favorites + 2 * comments, 0))
+        + extract(epoch FROM created_at)::double precision / 45000
+$$ LANGUAGE sql IMMUTABLE;
+
+UPDATE pins p SET favorite_count = f.n
+FROM (SELECT pin_id, count(*) AS n FROM favorites GROUP BY pin_id) f
+WHERE p.id = f.pin_id;
+
+UPDATE pins SET trending_score = pin_trending_score(views, favorite_count, comment_count, created_at);
+
+-- favorites -> pins.favorite_count
+CREATE OR REPLACE FUNCTION favorites_maintain_count() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE pins SET favorite_count = favorite_count + 1 WHERE id = NEW.pin_id;
+    ELSE
+        UPDATE pins SET favorite_count = favorite_count - 1 WHERE id = OLD.pin_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_favorites_count ON favorites;
+CREATE TRIGGER trg_favorites_count
+    AFTER INSERT OR DELETE ON favorites
+    FOR EACH ROW EXECUTE FUNCTION favorites_maintain_count();
+
+-- New pins are scored on insert; later input changes only mark the row for the job
+CREATE OR REPLACE FUNCTION pins_trending_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        NEW.trending_score := pin_trending_score(NEW.views, NEW.favorite_count, NEW.comment_count, NEW.created_at);
+    ELSE
+        NEW.trending_dirty := true;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_pins_trending_insert ON pins;
+CREATE TRIGGER trg_pins_trending_insert
+    BEFORE INSERT ON pins
+    FOR EACH ROW EXECUTE FUNCTION pins_trending_update();
+
+DROP TRIGGER IF EXISTS trg_pins_trending_update ON pins;
+CREATE TRIGGER trg_pins_trending_update
+    BEFORE UPDATE OF views, favorite_count, comment_count ON pins
+    FOR EACH ROW WHEN (
+        OLD.views IS DISTINCT FROM NEW.views
+        OR OLD.favorite_count IS DISTINCT FROM NEW.favorite_count
+        OR OLD.comment_count IS DISTINCT FROM NEW.comment_count
+    )
+    EXECUTE FUNCTION pins_trending_update();
+
+-- Top-K for the feed, and the job's work queue
+CREATE INDEX IF NOT EXISTS idx_pins_feed_trending ON pins(trending_score DESC, id DESC) WHERE reports < 10;
+CREATE INDEX IF NOT EXISTS idx_pins_trending_dirty ON pins(id) WHERE trending_dirty;
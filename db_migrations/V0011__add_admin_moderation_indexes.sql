@@ -0,0 +1,6 @@
+-- Keyset pagination of the admin user listing on (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at DESC, id DESC);
+
+-- Bulk bans with hide_content find a user's comments without a scan
+-- (pins are already covered by idx_pins_author)
+CREATE INDEX IF NOT EXISTS idx_comments_author ON comments(author_id);
@@ -8,11 +8,10 @@ import { api } from '@/lib/api';
 import { ScrollArea } from '@/components/ui/scroll-area';
 
 interface AdminPanelProps {
-  currentUser: any;
   onClose: () => void;
 }
 
-const AdminPanel = ({ currentUser, onClose }: AdminPanelProps) => {
+const AdminPanel = ({ onClose }: AdminPanelProps) => {
   const [users, setUsers] = useState<any[]>([]);
   const [search, setSearch] = useState('');
   const [loading, setLoading] = useState(false);
@@ -20,7 +19,7 @@ const AdminPanel = ({ currentUser, onClose }: AdminPanelProps) => {
   const loadUsers = async () => {
     setLoading(true);
     try {
-      const result = await api.getUsers(currentUser.id, search);
+      const result = await api.getUsers(search);
       if (result.users) {
         setUsers(result.users);
       }
@@ -37,7 +36,7 @@ const AdminPanel = ({ currentUser, onClose }: AdminPanelProps) => {
 
   const handleAction = async (action: string, userId: number) => {
     try {
-      await api.adminAction(currentUser.id, action, userId);
+      await api.adminAction(action, userId);
       toast.success('Action completed');
       loadUsers();
     } catch (error) {
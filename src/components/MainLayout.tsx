@@ -90,7 +90,7 @@ const MainLayout = ({ currentUser, onLogout }: MainLayoutProps) => {
         />
       )}
 
-      {showAdmin && <AdminPanel currentUser={currentUser} onClose={() => setShowAdmin(false)} />}
+      {showAdmin && <AdminPanel onClose={() => setShowAdmin(false)} />}
     </div>
   );
 };
@@ -1,11 +1,43 @@
-const API_URLS = {
-  auth: 'https://functions.poehali.dev/c8890f8d-dd4e-47ef-8d9b-9c9a2fe45709',
-  pins: 'https://functions.poehali.dev/2fc3f67a-0fd4-4e30-aa8e-a0e91e211259',
-  comments: 'https://functions.poehali.dev/1880ecd7-64be-4b09-b1f9-0c2420408f9a',
-  actions: 'https://functions.poehali.dev/3f3101e3-f8d3-444d-adf1-1b2d4aac84ea',
-  admin: 'https://functions.poehali.dev/b5cf0db9-5864-4d78-83a1-d554993a5335',
+// VITE_API_BASE points the app at a self-hosted gateway (backend/gateway/server.py)
+const API_BASE = import.meta.env.VITE_API_BASE as string | undefined;
+
+const API_URLS = API_BASE
+  ? {
+      auth: `${API_BASE}/auth`,
+      pins: `${API_BASE}/pins`,
+      comments: `${API_BASE}/comments`,
+      actions: `${API_BASE}/actions`,
+      admin: `${API_BASE}/admin`,
+    }
+  : {
+      auth: 'https://functions.poehali.dev/c8890f8d-dd4e-47ef-8d9b-9c9a2fe45709',
+      pins: 'https://functions.poehali.dev/2fc3f67a-0fd4-4e30-aa8e-a0e91e211259',
+      comments: 'https://functions.poehali.dev/1880ecd7-64be-4b09-b1f9-0c2420408f9a',
+      actions: 'https://functions.poehali.dev/3f3101e3-f8d3-444d-adf1-1b2d4aac84ea',
+      admin: 'https://functions.poehali.dev/b5cf0db9-5864-4d78-83a1-d554993a5335',
+    };
+
+const TOKEN_KEY = 'newbin_token';
+
+const authHeaders = (): Record<string, string> => {
+  const token = localStorage.getItem(TOKEN_KEY);
+  return token ? { Authorization: `Bearer ${token}` } : {};
 };
 
+// With read replicas, writes return X-Read-After (a WAL position); sending it on the
+// reads that follow keeps them off replicas that have not caught up to the write yet.
+const READ_AFTER_MS = 10000;
+let readAfter: { token: string; until: number } | null = null;
+
+const rememberWrite = (res: Response) => {
+  const token = res.headers.get('X-Read-After');
+  if (token) readAfter = { token, until: Date.now() + READ_AFTER_MS };
+  return res;
+};
+
+const readHeaders = (): Record<string, string> =>
+  readAfter && readAfter.until > Date.now() ? { 'X-Read-After': readAfter.token } : {};
+
 export const api = {
   async auth(action: 'register' | 'login', username: string, password: string) {
     const res = await fetch(API_URLS.auth, {
@@ -13,12 +45,25 @@ export const api = {
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ action, username, password }),
     });
-    return res.json();
+    const result = await res.json();
+    if (result.token) {
+      localStorage.setItem(TOKEN_KEY, result.token);
+    }
+    return result;
+  },
+
+  clearSession() {
+    localStorage.removeItem(TOKEN_KEY);
   },
 
-  async getPins(params?: { user_id?: number; sort?: string; search?: string }) {
+  async getPins(params?: { user_id?: number; sort?: string; search?: string; tag?: string; limit?: number; cursor?: string }) {
     const query = new URLSearchParams(params as any).toString();
-    const res = await fetch(`${API_URLS.pins}?${query}`);
+    const res = await fetch(`${API_URLS.pins}?${query}`, { headers: readHeaders() });
+    return res.json();
+  },
+
+  async getTags(limit?: number) {
+    const res = await fetch(`${API_URLS.pins}?action=tags${limit ? `&limit=${limit}` : ''}`, { headers: readHeaders() });
     return res.json();
   },
 
@@ -27,6 +72,10 @@ export const api = {
     return res.json();
   },
 
+  rawPinUrl(id: number) {
+    return `${API_URLS.pins}?id=${id}&raw=1`;
+  },
+
   async createPin(data: {
     title: string;
     content: string;
@@ -36,33 +85,51 @@ export const api = {
   }) {
     const res = await fetch(API_URLS.pins, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
       body: JSON.stringify(data),
     });
-    return res.json();
+    return rememberWrite(res).json();
   },
 
-  async deletePin(pin_id: number, user_id: number) {
+  async deletePin(pin_id: number) {
     const res = await fetch(API_URLS.pins, {
       method: 'DELETE',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ pin_id, user_id }),
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ pin_id }),
     });
-    return res.json();
+    return rememberWrite(res).json();
   },
 
-  async getComments(pin_id: number) {
-    const res = await fetch(`${API_URLS.comments}?pin_id=${pin_id}`);
+  async getComments(pin_id: number, params?: { limit?: number; cursor?: string }) {
+    const query = new URLSearchParams({ pin_id: String(pin_id), ...(params as any) }).toString();
+    const res = await fetch(`${API_URLS.comments}?${query}`, { headers: readHeaders() });
     return res.json();
   },
 
   async createComment(pin_id: number, author_id: number, content: string) {
     const res = await fetch(API_URLS.comments, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
       body: JSON.stringify({ pin_id, author_id, content }),
     });
-    return res.json();
+    return rememberWrite(res).json();
+  },
+
+  // Live comments from the gateway's change feed; returns a function that stops it.
+  // Without VITE_API_BASE there is no gateway, so callers keep re-fetching.
+  // Replays after a reconnect overlap what was already sent, so events are deduped by id.
+  subscribeComments(pin_id: number, since: number | undefined, onComment: (comment: any) => void) {
+    if (!API_BASE) return null;
+    const query = new URLSearchParams({ pin_id: String(pin_id), ...(since ? { since: String(since) } : {}) });
+    const source = new EventSource(`${API_BASE}/changes?${query}`);
+    const seen = new Set<number>();
+    source.addEventListener('comment', (event) => {
+      const { id, comment } = JSON.parse((event as MessageEvent).data);
+      if (seen.has(id)) return;
+      seen.add(id);
+      onComment(comment);
+    });
+    return () => source.close();
   },
 
   async report(entity_type: 'pin' | 'comment', entity_id: number) {
@@ -71,22 +138,31 @@ export const api = {
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ action: 'report', entity_type, entity_id }),
     });
-    return res.json();
+    return rememberWrite(res).json();
   },
 
-  async toggleFavorite(user_id: number, pin_id: number, is_favorite: boolean) {
+  async reportMany(reports: { entity_type: 'pin' | 'comment'; entity_id: number }[]) {
     const res = await fetch(API_URLS.actions, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'report', reports }),
+    });
+    return rememberWrite(res).json();
+  },
+
+  async toggleFavorite(user_id: number, pin_id: number, is_favorite: boolean) {
+    const res = await fetch(API_URLS.actions, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
       body: JSON.stringify({ action: 'favorite', user_id, pin_id, is_favorite }),
     });
-    return res.json();
+    return rememberWrite(res).json();
   },
 
   async getFavorites(user_id: number) {
     const res = await fetch(API_URLS.actions, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: { 'Content-Type': 'application/json', ...authHeaders(), ...readHeaders() },
       body: JSON.stringify({ action: 'get_favorites', user_id }),
     });
     return res.json();
@@ -95,23 +171,50 @@ export const api = {
   async isFavorite(user_id: number, pin_id: number) {
     const res = await fetch(API_URLS.actions, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: { 'Content-Type': 'application/json', ...authHeaders(), ...readHeaders() },
       body: JSON.stringify({ action: 'is_favorite', user_id, pin_id }),
     });
     return res.json();
   },
 
-  async getUsers(admin_id: number, search: string = '') {
-    const res = await fetch(`${API_URLS.admin}?admin_id=${admin_id}&search=${search}`);
+  async getFavoriteStatus(user_id: number, pin_ids: number[]) {
+    const res = await fetch(API_URLS.actions, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', ...authHeaders(), ...readHeaders() },
+      body: JSON.stringify({ action: 'favorite_status', user_id, pin_ids }),
+    });
     return res.json();
   },
 
-  async adminAction(admin_id: number, action: string, user_id: number) {
+  async checkReports(entity_type: 'pin' | 'comment', entity_ids: number[]) {
+    const res = await fetch(
+      `${API_URLS.actions}?action=check_reports&entity_type=${entity_type}&entity_ids=${entity_ids.join(',')}`,
+      { headers: readHeaders() }
+    );
+    return res.json();
+  },
+
+  async getUsers(search: string = '', cursor?: string) {
+    const query = new URLSearchParams({ search, ...(cursor ? { cursor } : {}) }).toString();
+    const res = await fetch(`${API_URLS.admin}?${query}`, { headers: { ...authHeaders(), ...readHeaders() } });
+    return res.json();
+  },
+
+  async adminAction(action: string, user_id: number) {
     const res = await fetch(API_URLS.admin, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ admin_id, action, user_id }),
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ action, user_id }),
     });
-    return res.json();
+    return rememberWrite(res).json();
+  },
+
+  async adminBatchAction(action: string, user_ids: number[], hide_content: boolean = false) {
+    const res = await fetch(API_URLS.admin, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', ...authHeaders() },
+      body: JSON.stringify({ action, user_ids, hide_content }),
+    });
+    return rememberWrite(res).json();
   },
 };
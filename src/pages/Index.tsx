@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import AuthScreen from '@/components/AuthScreen';
 import MainLayout from '@/components/MainLayout';
+import { api } from '@/lib/api';
 
 const Index = () => {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
@@ -25,6 +26,7 @@ const Index = () => {
 
   const handleLogout = () => {
     localStorage.removeItem('newbin_user');
+    api.clearSession();
     setCurrentUser(null);
     setIsAuthenticated(false);
   };